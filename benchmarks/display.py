@@ -0,0 +1,26 @@
+"""
+Measures how long NetworkxDisplay needs to prepare a solving graph whose states share many root facts, i.e. the time
+spent before drawing starts.
+
+Usage: python benchmarks/display.py
+"""
+import time
+
+from vizlo.graph import NetworkxDisplay
+from vizlo.main import VizloControl
+
+PROGRAM = "f(1..300). {x(1..7)}. y. z :- y."
+
+
+def main():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], PROGRAM)
+    g = ctl._make_graph_store()
+    start = time.perf_counter()
+    NetworkxDisplay(g)
+    print(f"nodes: {len(g)}")
+    print(f"display: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Measures how long SolveRunner needs to look up the active states of a single step while the rest of the solving graph
+grows. With the per-step frontier index the lookup time should stay flat.
+
+Usage: python benchmarks/frontier_scan.py
+"""
+import timeit
+
+from vizlo.solver import SolveRunner, SolverState, INITIAL_EMPTY_SET
+
+GRAPH_SIZES = [1_000, 10_000, 100_000]
+FRONTIER_SIZE = 100
+REPETITIONS = 1_000
+
+
+def make_runner(graph_size: int) -> SolveRunner:
+    runner = SolveRunner([["a."], ["b."]])
+    filler = [SolverState({i}, True, 1) for i in range(graph_size)]
+    runner.update_graph(INITIAL_EMPTY_SET, "a.", filler)
+    frontier = [SolverState({i}, True, 2) for i in range(FRONTIER_SIZE)]
+    runner.update_graph(filler[0], "b.", frontier)
+    return runner
+
+
+def main():
+    print(f"{'graph size':>12} {'lookup (us)':>12}")
+    for graph_size in GRAPH_SIZES:
+        runner = make_runner(graph_size)
+        seconds = timeit.timeit(lambda: runner.find_active_nodes_at_time_step(2), number=REPETITIONS)
+        print(f"{len(runner.graph):>12} {seconds / REPETITIONS * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compares building and traversing a layered solving graph with one million edges in a networkx.DiGraph and in a
+GraphStore. The traversal visits every edge with its rule set, as exporting the graph does. The lookup finds the
+parents of the last states added, as pruning the frontier does.
+
+Usage: python benchmarks/graph_store.py
+"""
+import time
+
+import networkx as nx
+
+from vizlo.graph_store import GraphStore
+from vizlo.solver import SolverState, INITIAL_EMPTY_SET
+
+NUMBER_OF_EDGES = 1_000_000
+FAN_OUT = 10
+RULE = ["a."]
+LOOKUPS = 10_000
+
+
+def make_edges():
+    edges = []
+    parents = [INITIAL_EMPTY_SET]
+    step = 0
+    while True:
+        step += 1
+        children = []
+        for parent in parents:
+            for _ in range(FAN_OUT):
+                child = SolverState.from_bits(0, True, step, 0, 0, INITIAL_EMPTY_SET._atoms)
+                edges.append((parent, child))
+                children.append(child)
+                if len(edges) == NUMBER_OF_EDGES:
+                    return edges
+        parents = children
+
+
+def build_networkx(edges):
+    g = nx.DiGraph()
+    g.add_node(INITIAL_EMPTY_SET)
+    for parent, child in edges:
+        g.add_edge(parent, child, rule=RULE)
+    return g
+
+
+def build_store(edges):
+    store = GraphStore(INITIAL_EMPTY_SET)
+    for parent, child in edges:
+        store.add_edge(parent, child, RULE)
+    return store
+
+
+def measure(name, build, traverse, edges):
+    start = time.perf_counter()
+    g = build(edges)
+    built = time.perf_counter()
+    traverse(g)
+    traversed = time.perf_counter()
+    for _, child in edges[-LOOKUPS:]:
+        list(g.predecessors(child))
+    done = time.perf_counter()
+    print(f"{name:>10}: build {built - start:8.2f}s, traverse {traversed - built:8.2f}s, "
+          f"lookup {done - traversed:8.2f}s")
+
+
+def main():
+    edges = make_edges()
+    print(f"edges: {len(edges)}, lookups: {LOOKUPS}")
+    measure("networkx", build_networkx, lambda g: sum(1 for _ in g.edges(data="rule")), edges)
+    measure("GraphStore", build_store, lambda g: len(g.edge_arrays()[2]), edges)
+
+
+if __name__ == "__main__":
+    main()
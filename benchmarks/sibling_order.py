@@ -0,0 +1,35 @@
+"""
+Compares ordering the siblings of one wide expansion by their sorted string forms, as it was done per sibling, with
+the batched order of _order_siblings, which sorts a boolean siblings x atoms matrix.
+
+Usage: python benchmarks/sibling_order.py
+"""
+import itertools
+import time
+
+import clingo
+
+from vizlo.solver import AtomTable, _order_siblings
+
+NUMBER_OF_CHOICES = 14
+
+
+def main():
+    atoms = AtomTable()
+    choices = [atoms.id_of(clingo.Function("choice", [clingo.Number(i)])) for i in range(NUMBER_OF_CHOICES)]
+    adds = [sum(1 << choice for choice, chosen in zip(choices, selection) if chosen)
+            for selection in itertools.product((False, True), repeat=NUMBER_OF_CHOICES)]
+    start = time.perf_counter()
+    per_sibling = sorted(range(len(adds)), key=lambda j: (bin(adds[j]).count("1"),
+                                                          sorted(str(atom) for atom in atoms.decode(adds[j]))))
+    middle = time.perf_counter()
+    batched = _order_siblings(adds, atoms)
+    end = time.perf_counter()
+    assert per_sibling == batched
+    print(f"siblings: {len(adds)}")
+    print(f"per sibling: {middle - start:.3f}s")
+    print(f"batched:     {end - middle:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
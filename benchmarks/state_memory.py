@@ -0,0 +1,40 @@
+"""
+Compares the memory a SolverState occupies with the memory the same state needs when its model, falses and adds are
+stored as Python sets of clingo.Symbols. Every state shares the same root facts, as they would in a solving graph.
+
+Usage: python benchmarks/state_memory.py
+"""
+import sys
+
+import clingo
+
+from vizlo.solver import SolverState, AtomTable
+
+NUMBER_OF_STATES = 100_000
+NUMBER_OF_FACTS = 50
+
+
+def size_as_sets(model, falses, adds) -> int:
+    return sys.getsizeof(object()) + sys.getsizeof({}) + sys.getsizeof(model) + sys.getsizeof(falses) + \
+           sys.getsizeof(adds)
+
+
+def main():
+    facts = {clingo.Function("fact", [clingo.Number(i)]) for i in range(NUMBER_OF_FACTS)}
+    atoms = AtomTable()
+    compact = 0
+    as_sets = 0
+    for i in range(NUMBER_OF_STATES):
+        added = clingo.Function("choice", [clingo.Number(i % 100)])
+        excluded = clingo.Function("choice", [clingo.Number((i + 1) % 100)])
+        model = facts | {added}
+        state = SolverState(model, True, 1 + i % 10, falses={excluded}, adds={added}, atoms=atoms)
+        compact += sys.getsizeof(state)
+        as_sets += size_as_sets(model, {excluded}, {added})
+    print(f"states: {NUMBER_OF_STATES}, atoms: {len(atoms)}")
+    print(f"bytes per state as sets of symbols: {as_sets / NUMBER_OF_STATES:.1f}")
+    print(f"bytes per SolverState:              {compact / NUMBER_OF_STATES:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,12 +18,12 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         "clingo>=5.4",
         "networkx>=2.4",
         "matplotlib>=3.2",
-        "numpy>=1.16",
+        "numpy>=1.17",
         "python-igraph>=0.8",
     ],
     test_suite="pytest",
@@ -1,10 +1,15 @@
+import asyncio
 import time
 
 import clingo
 import pytest
 
+from vizlo.cache import GraphCache
+from vizlo.exploration import Beam, Sample, count_atoms
 from vizlo.graph import NetworkxDisplay
+from vizlo.graph_store import GraphStore
 from vizlo.main import VizloControl, PythonModel
+from vizlo.solver import INITIAL_EMPTY_SET, SolveRunner
 import matplotlib.pyplot as plt
 
 
@@ -23,6 +28,7 @@ def test_parameters_exist():
     debuggo.paint(model_font_size=23)
     debuggo.paint(rule_font_size=13)
     debuggo.paint(dpi=100)
+    debuggo.paint(max_workers=2)
 
 
 def test_empty_program_raises_value_error():
@@ -127,9 +133,22 @@ def test_dont_repeat_constraints():
     g = ctl._make_graph(False)
     assert len(g.nodes) == 15, "Internal solver state should not merge nodes."
     display = NetworkxDisplay(g, merge_nodes=False)
-    assert len(display._ng) == 15, "Display graph should not be merged if not told to do so."
+    assert len(display._nodes) == 15, "Display graph should not be merged if not told to do so."
     display = NetworkxDisplay(g, merge_nodes=True)
-    assert len(display._ng), "Constrained partial models should not show up in the visualization."
+    assert len(display._nodes), "Constrained partial models should not show up in the visualization."
+
+
+def test_painting_reads_the_graph_store_without_networkx_copies(monkeypatch, tmp_path):
+    def to_networkx(self):
+        raise AssertionError("painting should not export the graph to networkx")
+
+    monkeypatch.setattr(GraphStore, "to_networkx", to_networkx)
+    ctl = VizloControl(["0"])
+    ctl.graph_cache = GraphCache(str(tmp_path))
+    ctl.add("base", [], "{a}. {b}. :- a. {c}.")
+    assert ctl.paint() is not None
+    assert ctl.paint() is not None
+    assert ctl.graph_cache.hits == 1
 
 
 def test_painting_without_initial_solving():
@@ -245,3 +264,138 @@ def test_load():
     ctl = VizloControl()
     ctl.load("program.lp")
     assert len(ctl.program) > 0
+
+
+def test_iter_solving_streams_steps():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a.")
+    increments = list(ctl.iter_solving())
+    assert len(increments) == 2
+    assert all(len(increment.states) > 0 for increment in increments)
+
+
+def test_iter_solving_solves_painter_models_together():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. {b}. c :- a.")
+    ctl.ground([("base", [])])
+    with ctl.solve(yield_=True) as handle:
+        for m in handle:
+            if m.contains(clingo.Function("a", [])):
+                ctl.add_to_painter(m)
+    increments = list(ctl.iter_solving())
+    assert [increment.step for increment in increments] == [1, 2, 3]
+    assert sum(len(increment.states) for increment in increments) + 1 == len(ctl._make_graph())
+
+
+def test_explore_expands_on_demand():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a.")
+    explorer = ctl.explore()
+    assert len(explorer.graph) == 1
+    children = explorer.expand(INITIAL_EMPTY_SET)
+    assert len(children) == 2
+    assert len(explorer.graph) == 3
+    with pytest.raises(ValueError):
+        ctl.explore(exploration=Beam(1))
+
+
+def test_projection_paints_the_same_graph(monkeypatch):
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a; b}. c :- a. d :- not c. {e} :- d.")
+    describe = lambda g: sorted((n.step, sorted(map(str, n.model)), n.is_still_active) for n in g)
+    expected = ctl._make_graph()
+    monkeypatch.setattr(SolveRunner, "solve", None)
+    assert describe(ctl._make_graph(projection=True)) == describe(expected)
+    assert isinstance(ctl.paint(projection=True), plt.Figure)
+
+
+@pytest.mark.parametrize("program", ["a(1). a(2).", "b :- a. {a}."])
+def test_projection_of_unsorted_programs_paints_the_same_graph(program):
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], program)
+    describe = lambda g: sorted((n.step, sorted(map(str, n.model)), n.is_still_active) for n in g)
+    assert describe(ctl._make_graph(False, projection=True)) == describe(ctl._make_graph(False))
+
+
+def test_min_frontier_order_keeps_the_graph_small():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{y}. {x(1..3)}. z. :- y, z.")
+    assert len(ctl._make_graph("min_frontier")) < len(ctl._make_graph())
+    assert isinstance(ctl.paint(sort_program="min_frontier"), plt.Figure)
+    with pytest.raises(ValueError):
+        ctl.paint(sort_program="shortest")
+
+
+def test_async_painting_and_streaming():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a.")
+
+    async def stream():
+        return [increment async for increment in ctl.iter_solving_async()]
+
+    increments = asyncio.run(stream())
+    assert [increment.step for increment in increments] == [1, 2]
+    assert asyncio.run(ctl.paint_async()) is not None
+
+
+def test_graph_cache_skips_solving(tmp_path, monkeypatch):
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a.")
+    ctl.graph_cache = GraphCache(str(tmp_path))
+    g = ctl._make_graph()
+    monkeypatch.setattr(ctl, "_make_solve_runner", None)
+    cached = ctl._make_graph()
+    assert ctl.graph_cache.hits == 1
+    assert len(cached) == len(g)
+    assert ctl.paint() is not None
+
+
+def test_graph_cache_skips_unnamed_beam_scores(tmp_path):
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a.")
+    ctl.graph_cache = GraphCache(str(tmp_path))
+    ctl._make_graph(exploration=Beam(1, lambda state: -len(state.model)))
+    ctl._make_graph(exploration=Beam(1, lambda state: len(state.model)))
+    assert ctl.graph_cache.hits == 0 and len(ctl.graph_cache) == 0
+    ctl._make_graph(exploration=Beam(1, count_atoms))
+    ctl._make_graph(exploration=Beam(1, count_atoms))
+    assert ctl.graph_cache.hits == 1
+    assert repr(Beam(1)) == "Beam(1, vizlo.exploration.count_atoms)"
+
+
+def test_painting_with_exploration_shows_pruned_counts():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a; b; c}. d :- a.")
+    g = ctl._make_graph(exploration=Beam(1))
+    display = NetworkxDisplay(g)
+    assert "[7 pruned]" in display.solver_state_to_string(INITIAL_EMPTY_SET)
+    assert ctl.paint(exploration=Sample(2)) is not None
+
+
+def test_painting_aggregates_wide_steps():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "x. {a; b; c}.")
+    g = ctl._make_graph(aggregate_threshold=3)
+    aggregate = next(node for node, count in g.nodes(data="model_count") if count is not None)
+    label = NetworkxDisplay(g).solver_state_to_string(aggregate)
+    assert "sometimes: " in label and "8 models" in label
+    assert ctl.paint(aggregate_threshold=3) is not None
+
+
+def test_repeated_painting_reuses_expansions():
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. {b}. :- a, b.")
+    ctl._make_graph()
+    misses = ctl.expansion_cache.misses
+    ctl._make_graph()
+    assert ctl.expansion_cache.misses == misses
+    assert ctl.expansion_cache.hits > 0
+
+
+def test_painter_universe_comes_from_the_solving_control(monkeypatch):
+    ctl = VizloControl(["0"])
+    ctl.add("base", [], "{a}. b :- a. c :- not a.")
+    ctl.add_to_painter([clingo.Function("a", []), clingo.Function("b", [])])
+    monkeypatch.setattr("vizlo.main.Control", None)
+    solve_runner, global_assumptions = ctl._make_solve_runner()
+    assert {str(atom) for atom, _ in global_assumptions[0]} == {"a", "b", "c"}
@@ -1,7 +1,19 @@
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import clingo
 import networkx as nx
+import pytest
 from clingo import Control
 
-from vizlo import solver, transform
+from vizlo import solver, transform, util
+from vizlo.budget import Budget
+from vizlo.cache import ExpansionCache, GraphCache
+from vizlo.exploration import Beam, Sample
+from vizlo.graph_store import GraphStore
 
 
 def get_transformed_test_program():
@@ -138,6 +150,516 @@ def test_has_reached_stable_model_function():
     assert one == two
 
 
+def test_partial_models_are_not_printed_unless_debugging(monkeypatch):
+    def fail(state):
+        raise AssertionError("printed a partial model")
+
+    monkeypatch.setattr(solver.SolverState, "__repr__", fail)
+    assert len(solver.SolveRunner([["{a}."], ["{b} :- a."]]).make_graph()) == 1 + 2 + 3
+
+
 def test_solver_state_is_hashable():
     solver_state = solver.SolverState(None, True)
     assert hash(solver_state)
+
+
+def test_rule_sets_share_one_grounded_control():
+    prg = [["a."], ["{b} :- a."], ["c :- b."]]
+    slv = solver.SolveRunner(prg)
+    assert isinstance(slv.control, Control)
+    assert len(slv.make_graph()) == 6
+
+
+def test_prefix_can_be_reactivated():
+    prg = [["{a}."], [":- a."], ["b :- not a."]]
+    slv = solver.SolveRunner(prg)
+    first = len(slv.make_graph())
+    slv.reset_graph()
+    assert len(slv.make_graph()) == first
+
+
+def test_frontier_index_contains_only_active_states_of_step():
+    prg = [["{b}."], [":- b."]]
+    slv = solver.SolveRunner(prg)
+    slv.make_graph()
+    assert slv.find_active_nodes_at_time_step(0) == [solver.INITIAL_EMPTY_SET]
+    assert len(slv.find_active_nodes_at_time_step(1)) == 2
+    assert len(slv.find_active_nodes_at_time_step(2)) == 1
+    assert all(node.step == 2 and node.is_still_active for node in slv.find_active_nodes_at_time_step(2))
+
+
+def test_parallel_expansion_matches_serial():
+    prg = [["{a}."], ["{b}."], ["{c} :- a."], [":- b, c."]]
+    serial = solver.SolveRunner(prg).make_graph()
+    parallel = solver.SolveRunner(prg, max_workers=2).make_graph()
+    assert [(n.step, n.model, n.is_still_active) for n in serial.nodes] == \
+           [(n.step, n.model, n.is_still_active) for n in parallel.nodes]
+    assert len(serial.edges) == len(parallel.edges)
+
+
+def test_assumption_sets_are_merged_without_duplicates():
+    prg = [["{a}."], ["b :- a."]]
+    a, b = clingo.Function("a", []), clingo.Function("b", [])
+    assumption_sets = [{(a, True), (b, True)}, {(a, True), (b, True)}, {(a, False), (b, False)}]
+    serial = solver.SolveRunner(prg).make_graph(assumption_sets)
+    parallel = solver.SolveRunner(prg, max_workers=2).make_graph(assumption_sets)
+    assert len(serial) == 5
+    assert [(n.step, n.model) for n in serial.nodes] == [(n.step, n.model) for n in parallel.nodes]
+    assert solver.INITIAL_EMPTY_SET in parallel
+
+
+def test_equivalent_states_share_one_node():
+    prg = [["{a}."], ["{a}."]]
+    signatures = {"{a}.": [("a", 0)]}
+    slv = solver.SolveRunner(prg, signatures)
+    g = slv.make_graph()
+    assert len(g) == 5
+    shared = [node for node in slv.find_active_nodes_at_time_step(2) if len(node.model) == 1]
+    assert len(shared) == 1
+    assert g.in_degree(shared[0]) == 2
+
+    tree = solver.SolveRunner(prg, signatures, deduplicate_states=False).make_graph()
+    assert len(tree) == 6
+
+
+def test_atom_table_round_trip():
+    atoms = solver.AtomTable()
+    symbols = {clingo.Function("a", [clingo.Number(i)]) for i in range(20)}
+    bits = atoms.encode(symbols)
+    assert isinstance(bits, int)
+    assert atoms.decode(bits) == symbols
+    assert atoms.decode(0) == frozenset()
+
+
+def test_memory_per_state_is_compact():
+    prg = [["x(1..50)."], ["{y(X)} :- x(X), X < 4."]]
+    slv = solver.SolveRunner(prg)
+    g = slv.make_graph()
+    assert len(g) == 10
+    assert slv.memory_per_state() < 250
+
+
+def test_iter_steps_yields_each_step():
+    prg = [["a."], ["{b} :- a."], ["c :- b."]]
+    slv = solver.SolveRunner(prg)
+    increments = list(slv.iter_steps())
+    assert [increment.step for increment in increments] == [1, 2, 3]
+    assert [len(increment.states) for increment in increments] == [1, 2, 2]
+    assert sum(len(increment.edges) for increment in increments) == slv.graph.number_of_edges()
+
+
+def test_iter_steps_can_stop_early():
+    prg = [["a."], ["{b} :- a."], ["c :- b."]]
+    slv = solver.SolveRunner(prg)
+    for increment in slv.iter_steps():
+        if increment.step == 2:
+            break
+    assert len(slv.graph) == 4
+
+
+def test_budget_limits_models_per_solve():
+    prg = [["{a; b; c}."]]
+    slv = solver.SolveRunner(prg, budget=Budget(max_models_per_solve=3))
+    g = slv.make_graph()
+    assert len(g) == 4
+    assert g.nodes[solver.INITIAL_EMPTY_SET]["truncated"]
+
+
+def test_budget_limits_frontier_and_states():
+    prg = [["{a; b}."], ["{c}."], ["d."]]
+    slv = solver.SolveRunner(prg, budget=Budget(max_frontier_size=2))
+    g = slv.make_graph()
+    assert len(slv.find_active_nodes_at_time_step(2)) == 2
+    assert sum(1 for _, truncated in g.nodes(data="truncated") if truncated) == 4
+
+    slv = solver.SolveRunner(prg, budget=Budget(max_states=6))
+    g = slv.make_graph()
+    assert len(slv.find_active_nodes_at_time_step(3)) == 0
+    assert any(truncated for _, truncated in g.nodes(data="truncated"))
+
+
+def test_budget_timeout_returns_partial_graph():
+    prg = [["{a; b}."], ["{c}."]]
+    slv = solver.SolveRunner(prg, budget=Budget(timeout=0))
+    g = slv.make_graph()
+    assert list(g.nodes) == [solver.INITIAL_EMPTY_SET]
+    assert g.nodes[solver.INITIAL_EMPTY_SET]["truncated"]
+
+
+def test_expansion_cache_is_shared_between_runs():
+    prg = [["{a}."], ["b :- a."]]
+    cache = ExpansionCache()
+    first = solver.SolveRunner(prg, expansion_cache=cache).make_graph()
+    assert cache.hits == 0 and cache.misses == 3
+    second = solver.SolveRunner(prg, expansion_cache=cache).make_graph()
+    assert cache.hits == 3
+    assert [(n.step, n.model) for n in first.nodes] == [(n.step, n.model) for n in second.nodes]
+
+
+def test_expansion_cache_is_bounded_by_atoms():
+    cache = ExpansionCache(max_atoms=4)
+    models = [(frozenset({i}), frozenset()) for i in range(3)]
+    for i, model in enumerate(models):
+        cache.put(i, model)
+    assert len(cache) == 2 and cache.atoms == 4
+    assert cache.get(0) is None
+    assert cache.get(2) == models[2]
+    cache.put(3, (frozenset(range(3)),))
+    assert len(cache) == 1 and cache.get(3) is not None
+    cache.put(4, (frozenset(range(5)),))
+    assert len(cache) == 0 and cache.atoms == 0
+
+
+def test_assumptions_are_indexed_by_signature():
+    a, b, c = clingo.Function("a", [clingo.Number(1)]), clingo.Function("b", []), clingo.Function("a", [])
+    index = solver.index_by_signature([(a, True), (b, False), (c, True)])
+    assert index[("a", 1)] == [(a, True)]
+    assert index[("b", 0)] == [(b, False)]
+    assert index[("a", 0)] == [(c, True)]
+
+
+def test_falses_of_head_signatures_are_not_assumed():
+    slv = solver.SolveRunner([["{a}."], ["{b}."]], {"{b}.": [("b", 0)]})
+    a, b = clingo.Function("a", []), clingo.Function("b", [])
+    state = solver.SolverState({a}, True, 1, falses={b}, atoms=slv.atoms)
+    slv.update_graph(solver.INITIAL_EMPTY_SET, slv._solvers[0].rule, [state])
+    assert sorted(len(child.model) for child in slv.expand(state)) == [1, 2]
+    assert slv.make_assumptions(slv.atoms.encode({a}), slv.atoms.encode({b})) == \
+        [slv.control.symbolic_atoms[a].literal, -slv.control.symbolic_atoms[b].literal]
+
+
+def test_literal_assumptions_match_symbol_assumptions():
+    prg = [["{a}."], ["{b} :- a."], [":- b, not c."], ["{c}."]]
+    a = clingo.Function("a", [])
+    for assumption_sets in [[set()], [{(a, True)}, {(a, False)}]]:
+        literals = solver.SolveRunner(prg).make_graph(assumption_sets)
+        symbols = solver.SolveRunner(prg, literal_assumptions=False).make_graph(assumption_sets)
+        assert [(n.step, n.model, n.is_still_active) for n in literals.nodes] == \
+               [(n.step, n.model, n.is_still_active) for n in symbols.nodes]
+
+
+def test_assuming_unknown_atom_is_unsatisfiable():
+    slv = solver.SolveRunner([["{a}."]])
+    a, x = slv.atoms.id_of(clingo.Function("a", [])), slv.atoms.id_of(clingo.Function("x", []))
+    assert slv.make_assumptions(1 << x, 0) is None
+    assert len(slv.make_assumptions(0, 1 << x)) == 0
+    assert all(isinstance(literal, int) for literal in slv.make_assumptions(1 << a, 0))
+    assert slv.solve(0, None) == ([], True)
+
+
+def test_make_graph_async_matches_make_graph():
+    prg = [["{a}."], ["{b} :- a."], ["c :- b."]]
+    g = asyncio.run(solver.SolveRunner(prg).make_graph_async())
+    assert [(n.step, n.model) for n in g.nodes] == [(n.step, n.model) for n in solver.SolveRunner(prg).make_graph()]
+
+    async def collect(slv):
+        return [increment.step async for increment in slv.aiter_steps()]
+
+    assert asyncio.run(collect(solver.SolveRunner(prg))) == [1, 2, 3]
+
+
+def test_cancelling_interrupts_solving():
+    slv = solver.SolveRunner([["{p(1..25)}."], ["q."]])
+    executor = ThreadPoolExecutor(1)
+
+    async def cancel_soon():
+        task = asyncio.ensure_future(slv.make_graph_async(executor=executor))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(cancel_soon())
+    executor.shutdown(wait=True)
+    assert time.monotonic() - start < 10
+    assert slv.cancelled
+    assert slv.graph.is_truncated(solver.INITIAL_EMPTY_SET)
+    assert len(slv.find_active_nodes_at_time_step(2)) == 0
+
+
+def test_graph_cache_round_trip(tmp_path):
+    g = solver.SolveRunner(transform.transform("{a}. b :- a. :- not b.")).make_graph()
+    cache = GraphCache(str(tmp_path))
+    key = GraphCache.make_key("{a}. b :- a. :- not b.", True)
+    assert cache.get(key) is None
+    cache.put(key, solver.graph_to_data(g))
+    restored = solver.graph_from_data(cache.get(key))
+    assert cache.hits == 1 and cache.misses == 1
+    assert solver.INITIAL_EMPTY_SET in restored
+    assert [(n.step, n.model, n.is_still_active) for n in restored] == \
+           [(n.step, n.model, n.is_still_active) for n in g]
+    assert sorted(str(rule) for _, _, rule in restored.edges(data="rule")) == \
+           sorted(str(rule) for _, _, rule in g.edges(data="rule"))
+
+
+def test_graph_data_round_trip_keeps_trees():
+    g = solver.SolveRunner([["{a}."], ["{a}."]], {"{a}.": [("a", 0)]}, deduplicate_states=False).make_graph()
+    restored = solver.graph_from_data(solver.graph_to_data(g))
+    assert len(g) == len(restored) == 6
+    assert len(restored.edges) == len(g.edges)
+    assert next(iter(restored)) is solver.INITIAL_EMPTY_SET
+
+
+def test_graph_cache_evicts_least_recently_used(tmp_path):
+    cache = GraphCache(str(tmp_path), max_size=250)
+    for i in range(3):
+        cache.put(str(i), ["x" * 100])
+        os.utime(os.path.join(str(tmp_path), f"{i}.json"), (i, i))
+    assert len(cache) == 2
+    assert cache.get("0") is None
+    assert cache.get("2") == ["x" * 100]
+    assert not any(name.endswith(".tmp") for name in os.listdir(str(tmp_path)))
+
+
+def test_beam_keeps_best_states_of_each_step():
+    prg = [["{a; b; c}."], ["d."]]
+    slv = solver.SolveRunner(prg, exploration=Beam(2))
+    g = slv.make_graph()
+    kept = slv.find_active_nodes_at_time_step(1)
+    assert len(kept) == 2
+    assert sorted(len(state.model) for state in kept) == [2, 3]
+    assert g.nodes[solver.INITIAL_EMPTY_SET]["pruned"] == 6
+    assert len(slv.find_active_nodes_at_time_step(2)) == 2
+    assert len(g) == 5
+
+
+def test_sample_is_seeded():
+    prg = [["{a; b; c; d}."], ["{e}."]]
+
+    def sample(seed, max_workers=1):
+        slv = solver.SolveRunner(prg, exploration=Sample(3, seed), max_workers=max_workers)
+        g = slv.make_graph()
+        assert g.nodes[solver.INITIAL_EMPTY_SET]["pruned"] == 13
+        return [(n.step, n.model) for n in g]
+
+    assert len(sample(1)) == 1 + 3 + 6
+    assert sample(1) == sample(1)
+    assert sample(1) == sample(1, max_workers=2)
+
+
+def test_wide_expansions_are_aggregated():
+    prg = [["x."], ["{a; b; c; d}."], [":- a, b."], ["e :- a."]]
+    slv = solver.SolveRunner(prg, aggregate_threshold=4)
+    g = slv.make_graph()
+    x, a, b = clingo.Function("x", []), clingo.Function("a", []), clingo.Function("b", [])
+    parent = slv.find_active_nodes_at_time_step(1)[0]
+    aggregates = list(g.successors(parent))
+    assert len(aggregates) == 1
+    attributes = g.nodes[aggregates[0]]
+    assert aggregates[0].model == {x}
+    assert {a, b} <= attributes["sometimes"]
+    assert attributes["model_count"] == 16 and attributes["model_count_is_exact"]
+    assert slv.find_active_nodes_at_time_step(2) == []
+
+    limited = solver.SolveRunner(prg, aggregate_threshold=4, aggregate_count_limit=10).make_graph()
+    counts = [count for _, count in limited.nodes(data="model_count") if count is not None]
+    assert counts == [10]
+    assert len(solver.SolveRunner(prg, aggregate_threshold=16).make_graph()) == 2 + 16 + 16 + 12
+
+
+def test_assumption_sets_share_their_prefixes():
+    prg = [["{a}."], ["{b}."], ["{c}."]]
+    symbols = {name: clingo.Function(name, []) for name in "abc"}
+    assumption_sets = [{(symbols["a"], True), (symbols["b"], b), (symbols["c"], c)}
+                       for b in (True, False) for c in (True, False)]
+    signatures = {f"{{{name}}}.": [(name, 0)] for name in "abc"}
+    slv = solver.SolveRunner(prg, signatures)
+    solved = []
+    solve = slv.solve
+    slv.solve = lambda step, assumptions, max_models=None: solved.append(step) or solve(step, assumptions, max_models)
+    g = slv.make_graph(assumption_sets)
+    assert solved == [0, 1, 1, 2, 2, 2, 2]
+    assert len(slv.find_active_nodes_at_time_step(3)) == 4
+    assert len(g) == 1 + 1 + 2 + 4
+
+
+def test_assumption_sets_keep_the_tree_without_deduplication():
+    prg = [["{a}."], ["{a}."], ["{b}."]]
+    signatures = {"{a}.": [("a", 0)], "{b}.": [("b", 0)]}
+    b = clingo.Function("b", [])
+    tree = solver.SolveRunner(prg, signatures, deduplicate_states=False).make_graph()
+    assert len(solver.SolveRunner(prg, signatures, deduplicate_states=False).make_graph([set()])) == len(tree)
+    g = solver.SolveRunner(prg, signatures, deduplicate_states=False).make_graph([{(b, True)}, {(b, False)}])
+    assert len(g) == len(tree) == 1 + 2 + 3 + 6
+    assert len(solver.SolveRunner(prg, signatures).make_graph([{(b, True)}, {(b, False)}])) == 1 + 2 + 2 + 4
+
+
+def test_delta_states_match_full_states():
+    prg = [["x(1..1000)."], ["{a}."], ["{b} :- a."], ["c :- b."], [":- c, not a."]]
+    full = solver.SolveRunner(prg)
+    g = full.make_graph()
+    delta = solver.SolveRunner(prg, delta_states=True, materialised_states=2)
+    h = delta.make_graph()
+    assert [(n.step, n.model, n.falses, n.adds, n.is_still_active) for n in g] == \
+           [(n.step, n.model, n.falses, n.adds, n.is_still_active) for n in h]
+    deep = [n for n in h if n.step == 5]
+    assert all(isinstance(n, solver.DeltaSolverState) for n in deep)
+    assert len(delta.materialised) <= 2
+    assert delta.memory_per_state() < full.memory_per_state()
+
+
+def test_delta_states_grow_with_their_adds_and_not_with_atom_ids():
+    def deep_state_sizes(facts):
+        prg = [[f"x(1..{facts})."]] + [[f"y({i})."] for i in range(10)]
+        slv = solver.SolveRunner(prg, delta_states=True, materialised_states=1)
+        g = slv.make_graph()
+        assert len(g) == 1 + 1 + 10
+        return [sys.getsizeof(n) for n in g if n.step > 1]
+
+    assert deep_state_sizes(500) == deep_state_sizes(5000)
+
+
+def test_graph_store_exports_networkx_and_igraph():
+    prg = [["{a}."], ["{b} :- a."], [":- b."]]
+    slv = solver.SolveRunner(prg, exploration=Beam(1))
+    g = slv.make_graph()
+    store = slv.graph
+    assert isinstance(store, GraphStore)
+    assert len(store) == len(g) and store.number_of_edges() == len(g.edges)
+    assert [n for n in store] == list(g.nodes)
+    assert store.pruned(solver.INITIAL_EMPTY_SET) == g.nodes[solver.INITIAL_EMPTY_SET]["pruned"] == 1
+    i = store.to_igraph()
+    assert i.vcount() == len(g) and i.ecount() == len(g.edges)
+    assert i.vs["step"] == [n.step for n in g]
+    root_children = store.successors(solver.INITIAL_EMPTY_SET)
+    assert root_children == list(g.successors(solver.INITIAL_EMPTY_SET))
+    assert store.predecessors(root_children[0]) == [solver.INITIAL_EMPTY_SET]
+
+
+def test_graph_store_neighbours_follow_added_edges():
+    states = [solver.SolverState({clingo.Function("x", [clingo.Number(i)])}, True, 1) for i in range(3)]
+    store = GraphStore(solver.INITIAL_EMPTY_SET)
+    store.add_edge(solver.INITIAL_EMPTY_SET, states[0], "a.")
+    assert store.successors(solver.INITIAL_EMPTY_SET) == [states[0]]
+    store.add_edge(solver.INITIAL_EMPTY_SET, states[1], "a.")
+    store.add_edge(states[1], states[2], "b.")
+    store.add_edge(states[0], states[2], "b.")
+    assert store.successors(solver.INITIAL_EMPTY_SET) == states[:2]
+    assert store.predecessors(states[2]) == [states[1], states[0]]
+    store.remove_states([states[1]])
+    assert store.predecessors(states[2]) == [states[0]]
+    assert store.successors(states[2]) == []
+
+
+def test_checkpoint_resumes_interrupted_solving(tmp_path):
+    prg = [["{a; b; c}."], ["{d} :- a."], ["e :- d."], [":- e, not b."]]
+    describe = lambda g: sorted((n.step, sorted(map(str, n.model)), g.nodes[n].get("pruned", 0)) for n in g)
+    expected = solver.SolveRunner(prg, exploration=Sample(3, seed=1)).make_graph()
+    interrupted = solver.SolveRunner(prg, exploration=Sample(3, seed=1), checkpoint_dir=str(tmp_path))
+    for increment in interrupted.iter_steps():
+        if increment.step == 2:
+            break
+    # the head of the checkpoint and one entry per completed step
+    assert len(GraphCache(str(tmp_path))) == 3
+    resumed = solver.SolveRunner(prg, exploration=Sample(3, seed=1), checkpoint_dir=str(tmp_path))
+    solved = []
+    solve = resumed.solve
+    resumed.solve = lambda step, assumptions, max_models=None: solved.append(step) or solve(step, assumptions,
+                                                                                           max_models)
+    g = resumed.make_graph()
+    assert min(solved) == 2
+    assert describe(g) == describe(expected)
+    assert len(g.edges) == len(expected.edges)
+    assert len(GraphCache(str(tmp_path))) == 0
+
+
+def test_expanding_on_demand_only_solves_the_selected_states():
+    prg = [["{a}."], ["{b}."], ["{c}."], [":- a, b, c."]]
+    slv = solver.SolveRunner(prg)
+    solved = []
+    solve = slv.solve
+    slv.solve = lambda step, assumptions, max_models=None: solved.append(step) or solve(step, assumptions, max_models)
+    children = slv.expand(solver.INITIAL_EMPTY_SET)
+    assert len(children) == 2 and len(slv.graph) == 3
+    grandchildren = slv.expand(children[0], steps=2)
+    assert len(grandchildren) == 4
+    assert solved == [0, 1, 2, 2]
+    assert slv.expand(children[0]) == slv.graph.successors(children[0])
+    assert solved == [0, 1, 2, 2]
+    slv.expand(solver.INITIAL_EMPTY_SET, steps=4)
+    assert len(slv.graph) == len(solver.SolveRunner(prg).make_graph())
+
+
+def test_expanding_on_demand_after_solving_does_not_solve_again():
+    prg = [["{a}."], ["{b}."]]
+    for deduplicate_states in (True, False):
+        slv = solver.SolveRunner(prg, deduplicate_states=deduplicate_states)
+        g = slv.make_graph()
+        slv.solve = None
+        assert len(slv.expand(solver.INITIAL_EMPTY_SET, steps=2)) == 4
+        assert len(slv.graph) == len(g)
+
+
+def test_expanding_on_demand_applies_the_budget():
+    slv = solver.SolveRunner([["{a}."], ["{b}."], ["{c}."]], budget=Budget(max_states=3))
+    children = slv.expand(solver.INITIAL_EMPTY_SET)
+    assert slv.budget.states == 3
+    assert slv.expand(children[0]) == []
+    assert slv.graph.is_truncated(children[0])
+    with pytest.raises(ValueError):
+        solver.SolveRunner([["{a}."]], exploration=Beam(1)).expand(solver.INITIAL_EMPTY_SET)
+
+
+def test_projection_matches_solving_step_by_step():
+    prg = [["{a}."], ["{b} :- a."], ["c :- b."], ["d :- not a."], ["{e(1..2)} :- d."]]
+    signatures = {"{a}.": [("a", 0)], "{b} :- a.": [("b", 0)], "c :- b.": [("c", 0)], "d :- not a.": [("d", 0)],
+                  "{e(1..2)} :- d.": [("e", 1)]}
+    describe = lambda g: [(n.step, n.model, n.falses, n.adds, n.is_still_active) for n in g]
+    for deduplicate_states in (True, False):
+        expected = solver.SolveRunner(prg, signatures, deduplicate_states=deduplicate_states).make_graph()
+        slv = solver.SolveRunner(prg, signatures, deduplicate_states=deduplicate_states, projection=True)
+        solved = []
+        slv.solve = lambda step, assumptions, max_models=None: solved.append(step)
+        g = slv.make_graph()
+        assert solved == []
+        assert describe(g) == describe(expected)
+        assert [(describe([u])[0], describe([v])[0]) for u, v in g.edges] == \
+               [(describe([u])[0], describe([v])[0]) for u, v in expected.edges]
+
+
+def test_projection_falls_back_if_constraints_are_present():
+    prg = [["{a}."], ["{b} :- a."], [":- b."]]
+    signatures = {"{a}.": [("a", 0)], "{b} :- a.": [("b", 0)]}
+    slv = solver.SolveRunner(prg, signatures, projection=True)
+    solved = []
+    solve = slv.solve
+    slv.solve = lambda step, assumptions, max_models=None: solved.append(step) or solve(step, assumptions, max_models)
+    g = slv.make_graph()
+    assert len(solved) > 0
+    assert len(g) == len(solver.SolveRunner(prg, signatures).make_graph())
+
+
+@pytest.mark.parametrize("preceding_atoms", [0, 1001])
+def test_siblings_are_ordered_by_their_adds(preceding_atoms):
+    atoms = solver.AtomTable()
+    atoms.encode(clingo.Function("x", [clingo.Number(i)]) for i in range(preceding_atoms))
+    symbols = [clingo.Function(name, arguments) for name, arguments in
+               [("b", []), ("a", [clingo.Number(10)]), ("a", [clingo.Number(2)]), ("c", []), ("a", [])]]
+    adds = [atoms.encode(added) for added in ([symbols[0], symbols[3]], [symbols[1]], [], [symbols[2], symbols[0]],
+                                              [symbols[4]], [symbols[1], symbols[3]])]
+    expected = sorted(range(len(adds)), key=lambda j: (bin(adds[j]).count("1"),
+                                                       sorted(str(atom) for atom in atoms.decode(adds[j]))))
+    assert solver._order_siblings(adds, atoms) == expected == [2, 4, 1, 5, 3, 0]
+
+
+def test_transformed_programs_enumerate_no_duplicate_models(monkeypatch):
+    monkeypatch.setattr(util, "DEBUG", True)
+    t = transform.JustTheRulesTransformer()
+    prg = t.transform("{a}. {b; c} :- a. d :- b. {e; f} :- d.")
+    slv = solver.SolveRunner(prg, t.rule2signatures)
+    g = slv.make_graph()
+    assert slv.enumerated_models == len(g) - 1 > 0
+    assert slv.duplicate_models == 0
+
+
+def test_duplicate_models_are_counted_if_signatures_leave_out_atoms(monkeypatch):
+    prg = [["{a}."], ["{b; aux}."]]
+    signatures = {"{a}.": [("a", 0)], "{b; aux}.": [("b", 0)]}
+    slv = solver.SolveRunner(prg, signatures)
+    slv.make_graph()
+    assert (slv.enumerated_models, slv.duplicate_models) == (0, 0)
+    monkeypatch.setattr(util, "DEBUG", True)
+    slv = solver.SolveRunner(prg, signatures)
+    slv.make_graph()
+    assert (slv.enumerated_models, slv.duplicate_models) == (2 + 8, 4)
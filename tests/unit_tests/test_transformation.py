@@ -276,3 +276,13 @@ def test_recursion_detection_recognizes_recursion_with_choice_rules():
     assert len(g.nodes) == 2, "There should be rule nodes in the dependency graph."
     assert len(g.edges) == 2, "There should be no dependency in the dependency graph."
     assert len(list(nx.simple_cycles(g))) == 1, "There should be a circle in the dependency graph."
+
+
+def test_min_frontier_order_narrows_before_it_multiplies():
+    prg = "{y}. {x(1..3)}. z. :- y, z."
+    sorted_program = transform.transform(prg, "min_frontier")
+    rule_sets = [str(rule_set[0]) for rule_set in sorted_program]
+    assert len(rule_sets) == 4
+    assert rule_sets[0] == "z."
+    assert rule_sets[2].startswith("#false")
+    assert "x(" in rule_sets[3]
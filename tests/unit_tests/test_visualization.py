@@ -2,7 +2,7 @@ import clingo
 import networkx as nx
 import matplotlib.pyplot as plt
 
-from vizlo.solver import SolverState
+from vizlo.solver import AtomTable, SolverState
 from vizlo.graph import NetworkxDisplay
 from vizlo.util import filter_prg
 
@@ -136,7 +136,20 @@ def test_drawing_unsat_and_empty_look_different():
 def test_merge_nodes():
     g = create_diGraph_with_mergable_nodes()
     display = NetworkxDisplay(g, False)
-    assert len(display._ng) == 6, "display should merge nodes with identical sets on the same step."
+    assert len(display._nodes) == 6, "display should merge nodes with identical sets on the same step."
+
+
+def test_merging_nodes_does_not_decode_models(monkeypatch):
+    g = create_diGraph_with_mergable_nodes()
+    for _ in range(200):
+        g.add_edge(next(iter(g)), SolverState({"a", "b"}, True, 1), rule="{a ; b}.")
+
+    def decode(self, bits):
+        raise AssertionError("merging nodes should compare bitsets")
+
+    monkeypatch.setattr(AtomTable, "decode", decode)
+    display = NetworkxDisplay(g)
+    assert len(display._nodes) == 6
 
 
 def test_returns_printable_array():
@@ -1 +1,3 @@
 from .main import VizloControl
+from .budget import Budget
+from .exploration import Beam, Sample
@@ -0,0 +1,75 @@
+import os
+import time
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def current_rss() -> int:
+    """
+    Returns the resident set size of the current process in bytes, or 0 if it can't be determined.
+    On Linux the current size is read from /proc, elsewhere the peak size reported by resource is used.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+class Budget:
+    """
+    Limits how much of the search space a SolveRunner explores. All limits are optional.
+    Once a limit is hit, the SolveRunner returns the graph built so far and marks every SolverState that was not
+    expanded completely as truncated.
+    """
+
+    def __init__(self, max_models_per_solve: Optional[int] = None, max_frontier_size: Optional[int] = None,
+                 max_states: Optional[int] = None, timeout: Optional[float] = None,
+                 max_memory: Optional[int] = None):
+        """
+        :param max_models_per_solve: the maximum number of children enumerated when expanding a single partial model.
+        :param max_frontier_size: the maximum number of partial models that are expanded at each step.
+        :param max_states: the maximum number of SolverStates in the solving graph.
+        :param timeout: the wall-clock time in seconds after which solving is interrupted.
+        :param max_memory: the resident set size in bytes at which solving stops.
+        """
+        self.max_models_per_solve = max_models_per_solve
+        self.max_frontier_size = max_frontier_size
+        self.max_states = max_states
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.states = 0
+        self._deadline: Optional[float] = None
+
+    def start(self) -> None:
+        """
+        Resets the counters and starts the clock, called by the SolveRunner before solving.
+        """
+        self.states = 1
+        self._deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+    def remaining_time(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def add_states(self, number: int) -> None:
+        self.states += number
+
+    def is_timed_out(self) -> bool:
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def is_exhausted(self) -> bool:
+        if self.max_states is not None and self.states >= self.max_states:
+            return True
+        if self.is_timed_out():
+            return True
+        return self.max_memory is not None and current_rss() >= self.max_memory
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+
+class LRUCache:
+    """
+    A least recently used cache that counts its hits and misses.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        :param maxsize: the maximum number of entries that are kept.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class ExpansionCache(LRUCache):
+    """
+    A least recently used cache for the children of expanded partial models.
+    The SolveRunner keys each entry by a digest of the guarded program, the step and the effective assumptions, so the
+    cache can be shared by all painter assumption sets and by consecutive paint() calls. Its size is the number of
+    atoms in all cached models rather than the number of entries, as a single wide expansion can hold thousands of
+    models.
+    """
+
+    def __init__(self, max_atoms: int = 1_000_000):
+        """
+        :param max_atoms: the maximum number of atoms kept in all models together, an empty model counts as one.
+        """
+        super().__init__(maxsize=sys.maxsize)
+        self.max_atoms = max_atoms
+        self.atoms = 0
+
+    def put(self, key: Hashable, value: Tuple) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.atoms -= _count_atoms(previous)
+        super().put(key, value)
+        self.atoms += _count_atoms(value)
+        while self.atoms > self.max_atoms:
+            _, evicted = self._entries.popitem(last=False)
+            self.atoms -= _count_atoms(evicted)
+
+    def clear(self) -> None:
+        super().clear()
+        self.atoms = 0
+
+
+def _count_atoms(models: Tuple) -> int:
+    return sum(max(len(model), 1) for model in models)
+
+
+class GraphCache:
+    """
+    A cache of solving graphs in a directory on disk, so that painting the same program again skips transformation,
+    grounding and solving. Each entry is a JSON file named by its key. Entries are written to a temporary file first and
+    then renamed, so concurrent writers never leave a partially written entry behind. Once the directory grows beyond
+    max_size, the least recently used entries are removed.
+    """
+
+    SUFFIX = ".json"
+
+    def __init__(self, directory: str, max_size: int = 256 * 1024 * 1024):
+        """
+        :param directory: the cache directory, it is created if it does not exist.
+        :param max_size: the maximum size of all entries in bytes.
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        Hashes JSON serialisable parts into a key.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)
+            # The modification time orders the entries for eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except ValueError:
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        :param key: a key as created by make_key
+        :param value: a JSON serialisable value
+        """
+        fd, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(temporary_path, self._path(key))
+        except BaseException:
+            self._remove(temporary_path)
+            raise
+        self._evict()
+
+    def remove(self, key: str) -> None:
+        self._remove(self._path(key))
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            size -= entry_size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._entries())
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            self._remove(path)
+        self.hits = 0
+        self.misses = 0
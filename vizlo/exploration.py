@@ -0,0 +1,138 @@
+import random
+from typing import Callable, List, Optional, Any
+
+
+def count_atoms(solver_state) -> int:
+    """
+    The default score of Beam, prefers partial models that derived more atoms.
+    """
+    return len(solver_state.model)
+
+
+def _qualified_name(function) -> Optional[str]:
+    """
+    :return: the module and qualified name of a module level function, None for lambdas and local functions, whose
+    names don't tell them apart
+    """
+    name = getattr(function, "__qualname__", None)
+    if name is None or "<" in name:
+        return None
+    return f"{function.__module__}.{name}"
+
+
+class Exploration:
+    """
+    Decides which part of the search space a SolveRunner explores. The base class explores it completely, subclasses
+    prune children or frontier states. The SolveRunner removes pruned states from the solving graph and counts them in
+    the node attribute "pruned" of their parents, so the drawing shows how much of the fan-out was left out.
+    """
+
+    def start(self) -> None:
+        """
+        Called by the SolveRunner before solving, resets random generators and the like.
+        """
+
+    def get_state(self) -> Any:
+        """
+        :return: a JSON serialisable state, e.g. of a random generator, that set_state restores when solving resumes
+        from a checkpoint.
+        """
+        return None
+
+    def set_state(self, state: Any) -> None:
+        pass
+
+    def selects_frontier(self) -> bool:
+        """
+        Tells whether select_frontier may drop partial models, see SolveRunner.can_expand_on_demand.
+        """
+        return type(self).select_frontier is not Exploration.select_frontier
+
+    def has_stable_repr(self) -> bool:
+        """
+        Tells whether repr identifies this exploration across runs, so that graphs and checkpoints can be stored under
+        it.
+        """
+        return True
+
+    def select_children(self, children: List) -> List:
+        """
+        Selects which children of one expansion are kept.
+        :param children: the SolverStates created by expanding a partial model, ordered deterministically
+        :return: the kept SolverStates in their original order
+        """
+        return children
+
+    def select_frontier(self, frontier: List) -> List:
+        """
+        Selects which of the partial models of a step are expanded further.
+        :param frontier: the active SolverStates of a step
+        :return: the kept SolverStates in their original order
+        """
+        return frontier
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class Beam(Exploration):
+    """
+    Keeps the width best partial models of each step, as rated by score.
+    """
+
+    def __init__(self, width: int, score: Optional[Callable[[Any], Any]] = None):
+        """
+        :param width: the maximum number of partial models that are expanded at each step.
+        :param score: maps a SolverState to a comparable value, higher is better. Defaults to count_atoms.
+        """
+        self.width = width
+        self.score = count_atoms if score is None else score
+
+    def select_frontier(self, frontier: List) -> List:
+        if len(frontier) <= self.width:
+            return frontier
+        # sorted is stable, so ties keep the order of the frontier
+        best = set(sorted(frontier, key=self.score, reverse=True)[:self.width])
+        return [state for state in frontier if state in best]
+
+    def has_stable_repr(self) -> bool:
+        return _qualified_name(self.score) is not None
+
+    def __repr__(self):
+        return f"Beam({self.width}, {_qualified_name(self.score) or self.score})"
+
+
+class Sample(Exploration):
+    """
+    Keeps a random subset of the children of each expansion. The subset only depends on the seed, so repeated runs draw
+    the same graph.
+    """
+
+    def __init__(self, size: int, seed: int = 0):
+        """
+        :param size: the maximum number of children kept for each expanded partial model.
+        :param seed: the seed of the random generator.
+        """
+        self.size = size
+        self.seed = seed
+        self._random = random.Random(seed)
+
+    def start(self) -> None:
+        self._random = random.Random(self.seed)
+
+    def get_state(self) -> Any:
+        version, internal_state, gauss_next = self._random.getstate()
+        return [version, list(internal_state), gauss_next]
+
+    def set_state(self, state: Any) -> None:
+        version, internal_state, gauss_next = state
+        self._random.setstate((version, tuple(internal_state), gauss_next))
+
+    def select_children(self, children: List) -> List:
+        if len(children) <= self.size:
+            return children
+        kept = sorted(self._random.sample(range(len(children)), self.size))
+        return [children[i] for i in kept]
+
+    def __repr__(self):
+        return f"Sample({self.size}, {self.seed})"
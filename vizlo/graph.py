@@ -1,9 +1,10 @@
 import math
 
-from typing import Tuple, Dict, Any, Collection, Union
+from typing import Tuple, Dict, Any, Collection, List, Union
 from collections import Counter
 import igraph
 import networkx as nx
+import numpy as np
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
 from matplotlib.patches import ConnectionPatch
@@ -11,6 +12,7 @@ from matplotlib.path import Path
 import matplotlib.pyplot as plt
 import matplotlib.patches as mp
 
+from vizlo.graph_store import GraphStore
 from vizlo.solver import SolverState
 from vizlo.transform import FindRecursiveRulesTransformer
 from vizlo.types import ASTRuleSet
@@ -122,16 +124,56 @@ def adjust_figure_size(plotted_nodes: Dict[SolverState, Any], fig: Figure):
 class NetworkxDisplay:
 
     def __init__(self, graph, atom_draw_maximum=20, print_changes_only=True, merge_nodes=True):
-        if merge_nodes:
-            self._ng = self.merge_nodes_on_same_step(graph)
-        else:
-            self._ng = graph
+        """
+        :param graph: the solving graph, a GraphStore or its networkx export. Nodes, edges and attributes are read from
+        the arrays of the store, networkx is only used for drawing.
+        """
+        if isinstance(graph, nx.DiGraph):
+            graph = GraphStore.from_networkx(graph)
+        self._read_graph(graph, merge_nodes)
         self.atom_draw_maximum = atom_draw_maximum
         self._print_changes_only = print_changes_only
-        self.max_depth = max(n.step for n in self._ng.nodes())
-        self._ig: igraph.Graph = self.nxgraph_to_igraph(self._ng)
+        self.max_depth = max(n.step for n in self._nodes)
         log(f"Initialized {self.__class__}")
 
+    def _read_graph(self, store: GraphStore, merge_nodes: bool) -> None:
+        """
+        Reads the vertices, edges and attributes to draw from a store. Vertex i is self._nodes[i], the root is vertex 0.
+        """
+        state_ids = store.state_ids()
+        if merge_nodes:
+            representatives = self.merge_nodes_on_same_step(store)[state_ids]
+        else:
+            representatives = state_ids
+        # Merged states become the vertex of their representative, in the order in which the first of them was added.
+        _, first = np.unique(representatives, return_index=True)
+        vertex_states = representatives[np.sort(first)]
+        vertices = np.zeros(int(state_ids[-1]) + 1, dtype=np.int64)
+        vertices[vertex_states] = np.arange(len(vertex_states))
+        vertices[state_ids] = vertices[representatives]
+        self._nodes: List[SolverState] = [store.state(state_id) for state_id in vertex_states.tolist()]
+        self._attributes: Dict[SolverState, Dict[str, Any]] = {}
+        for node in self._nodes:
+            attributes = store.node_attributes(node)
+            if attributes:
+                self._attributes[node] = attributes
+
+        parents, children, rule_ids = store.edge_arrays()
+        parents, children = vertices[parents], vertices[children]
+        # Edges that merging made equal are drawn once. The edges of each vertex are kept together and in the order they
+        # were added, like in the adjacency of a networkx graph.
+        _, first = np.unique(parents * len(self._nodes) + children, return_index=True)
+        first = np.sort(first)
+        parents, children, rule_ids = parents[first], children[first], rule_ids[first]
+        order = np.argsort(parents, kind="stable")
+        parents, children, rule_ids = parents[order], children[order], rule_ids[order]
+        self._edges: List[Tuple[SolverState, SolverState, ASTRuleSet]] = [
+            (self._nodes[parent], self._nodes[child], store.rule(rule_id))
+            for parent, child, rule_id in zip(parents.tolist(), children.tolist(), rule_ids.tolist())]
+        self._out_degree = np.bincount(parents, minlength=len(self._nodes))
+        self._ig = igraph.Graph(n=len(self._nodes), edges=np.stack((parents, children), axis=1).tolist(),
+                                directed=True)
+
     def model_to_string(self, model: Collection):
         if self.atom_draw_maximum <= 0:
             return ""
@@ -151,15 +193,34 @@ class NetworkxDisplay:
 
     def solver_state_to_string(self, solver_state: SolverState) -> str:
         atoms_to_draw = solver_state.adds if self._print_changes_only and self.max_depth != solver_state.step else solver_state.model
-        return self.model_to_string(atoms_to_draw)
-
-    def merge_nodes_on_same_step(self, g: nx.Graph):
-        mapping = {}
-        for x in g.nodes():
-            for y in g.nodes():
-                if x.step == y.step and x.model == y.model and x.is_still_active == y.is_still_active:
-                    mapping[x] = y
-        return nx.relabel_nodes(g, mapping)
+        label = self.model_to_string(atoms_to_draw)
+        if solver_state not in self._attributes:
+            return label
+        attributes = self._attributes[solver_state]
+        if "model_count" in attributes:
+            model_count = f"{attributes['model_count']}{'' if attributes['model_count_is_exact'] else '+'}"
+            label = f"always: {label}\nsometimes: {self.model_to_string(attributes['sometimes'])}\n" \
+                    f"{model_count} models"
+        pruned = attributes.get("pruned", 0)
+        if pruned:
+            label += f"\n[{pruned} pruned]"
+        if attributes.get("truncated", False):
+            label += "\n[truncated]"
+        return label
+
+    def merge_nodes_on_same_step(self, store: GraphStore) -> np.ndarray:
+        """
+        Merges the nodes that agree on step, model and activity into the last of them. The nodes are grouped by their
+        bitsets, so no model has to be decoded.
+        :return: the id of the state each state id is merged into
+        """
+        # Bitsets are only comparable within one AtomTable, the empty model is the same in every table.
+        key = lambda x: (x.step, id(x._atoms) if x._model else None, x._model, x.is_still_active)
+        state_ids = store.state_ids().tolist()
+        groups = {key(store.state(state_id)): state_id for state_id in state_ids}
+        representatives = np.zeros(state_ids[-1] + 1, dtype=np.int64)
+        representatives[state_ids] = [groups[key(store.state(state_id))] for state_id in state_ids]
+        return representatives
 
     def create_rule_positions(self, pos: Dict[SolverState, Tuple[float, float]],
                               labels: Dict[Tuple[SolverState, SolverState], str]):
@@ -205,14 +266,14 @@ class NetworkxDisplay:
 
         return text_items
 
-    def split_into_edge_lists(self, g: nx.Graph) -> Tuple:
+    def split_into_edge_lists(self, edges: List[Tuple[SolverState, SolverState, ASTRuleSet]]) -> Tuple:
         constraints = []
         normal = []
-        for edge in g.edges(data=True):
-            if "#false" in str(edge[2]["rule"]):
-                constraints.append(edge)
+        for parent, child, rule in edges:
+            if "#false" in str(rule):
+                constraints.append((parent, child))
             else:
-                normal.append(edge)
+                normal.append((parent, child))
         return normal, constraints
 
     def draw(self, figsize: Union[Tuple[float, float], None] = None, dpi: int = 300, rule_font_size: int = 12,
@@ -234,7 +295,7 @@ class NetworkxDisplay:
         :return:
         """
         # 1. Figure out node positions using igraph
-        log(f"Drawing graph with {len(self._ng)} nodes.")
+        log(f"Drawing graph with {len(self._nodes)} nodes.")
         pos = self.make_node_positions()
         fig = plt.figure(dpi=dpi)
         specs = fig.add_gridspec(ncols=2, nrows=1, width_ratios=[1, 2])
@@ -292,7 +353,9 @@ class NetworkxDisplay:
         recursive_models = {node: label for node, label in recursive_models.items() if
                             node not in recursive_and_stable_models}
         plotted_nodes = {}
-        x = nx.draw_networkx_labels(self._ng, pos,
+        # The labels are given, so networkx doesn't need the nodes of the graph.
+        g = nx.DiGraph()
+        x = nx.draw_networkx_labels(g, pos,
                                     font_size=model_font_size,
                                     ax=graph_axis,
                                     bbox={'facecolor': 'yellowgreen',
@@ -301,7 +364,7 @@ class NetworkxDisplay:
                                           'pad': 1},
                                     labels=recursive_and_stable_models)
         plotted_nodes.update(x)
-        x = nx.draw_networkx_labels(self._ng, pos,
+        x = nx.draw_networkx_labels(g, pos,
                                     font_size=model_font_size,
                                     ax=graph_axis,
                                     bbox={'facecolor': 'dodgerblue',
@@ -310,7 +373,7 @@ class NetworkxDisplay:
                                           'pad': 1},
                                     labels=normal_models)
         plotted_nodes.update(x)
-        x = nx.draw_networkx_labels(self._ng, pos,
+        x = nx.draw_networkx_labels(g, pos,
                                     font_size=model_font_size,
                                     ax=graph_axis,
                                     bbox={'facecolor': 'dodgerblue',
@@ -319,7 +382,7 @@ class NetworkxDisplay:
                                           'pad': 1},
                                     labels=recursive_models)
         plotted_nodes.update(x)
-        x = nx.draw_networkx_labels(self._ng, pos,
+        x = nx.draw_networkx_labels(g, pos,
                                     font_size=model_font_size,
                                     ax=graph_axis,
                                     font_color='white',
@@ -330,7 +393,7 @@ class NetworkxDisplay:
                                           'pad': 1},
                                     labels=constraint_models)
         plotted_nodes.update(x)
-        x = nx.draw_networkx_labels(self._ng, pos,
+        x = nx.draw_networkx_labels(g, pos,
                                     font_size=model_font_size,
                                     ax=graph_axis,
                                     font_color='black',
@@ -343,14 +406,18 @@ class NetworkxDisplay:
         return plotted_nodes
 
     def draw_edges(self, ax: Axes, pos: Dict[SolverState, Tuple[float, float]]):
-        normal_edge_list, constraint_edge_list = self.split_into_edge_lists(self._ng)
-        nx.draw_networkx_edges(self._ng, pos,
+        normal_edge_list, constraint_edge_list = self.split_into_edge_lists(self._edges)
+        # The edges and nodes are given, networkx only needs to know that they are directed.
+        g = nx.DiGraph()
+        nx.draw_networkx_edges(g, pos,
                                edgelist=normal_edge_list,
+                               nodelist=self._nodes,
                                alpha=EDGE_ALPHA,
                                ax=ax,
                                node_size=NODE_SIZE)
-        nx.draw_networkx_edges(self._ng, pos,
+        nx.draw_networkx_edges(g, pos,
                                edgelist=constraint_edge_list,
+                               nodelist=self._nodes,
                                alpha=EDGE_ALPHA,
                                style="dashed",
                                ax=ax,
@@ -411,27 +478,26 @@ class NetworkxDisplay:
         recursive_models = {}
         stable_models = {}
         rule_labels = {}
-        for node, nbrsdict in self._ng.adjacency():
+        for node, out_degree in zip(self._nodes, self._out_degree.tolist()):
             if not node.is_still_active:
                 constraint_models[node] = self.solver_state_to_string(node)
-            elif len(self._ng[node]) == 0:
+            elif out_degree == 0 and "model_count" not in self._attributes.get(node, {}):
                 stable_models[node] = self.solver_state_to_string(node)
             else:
                 normal_models[node] = self.solver_state_to_string(node)
 
-            for neighbor, edge_attrs in nbrsdict.items():
-                rule = edge_attrs["rule"]
-                if self.is_recursive(rule):
-                    recursive_models[neighbor] = self.solver_state_to_string(neighbor)
-                    rule_labels[(node, neighbor)] = self.make_rec_label(rule)
-                else:
-                    rule_labels[(node, neighbor)] = self.make_rule_label(rule)
+        for node, neighbor, rule in self._edges:
+            if self.is_recursive(rule):
+                recursive_models[neighbor] = self.solver_state_to_string(neighbor)
+                rule_labels[(node, neighbor)] = self.make_rec_label(rule)
+            else:
+                rule_labels[(node, neighbor)] = self.make_rule_label(rule)
         return normal_models, recursive_models, constraint_models, stable_models, rule_labels
 
     def make_node_positions(self):
         layout = self._ig.layout_reingold_tilford(root=[0])
         layout.rotate(180)
-        nx_map = {i: node for i, node in enumerate(self._ng.nodes())}
+        nx_map = {i: node for i, node in enumerate(self._nodes)}
         pos = self.igraph_to_networkx_layout(layout, nx_map)
         return pos
 
@@ -444,7 +510,8 @@ class NetworkxDisplay:
 
     @staticmethod
     def nxgraph_to_igraph(nxgraph):
-        return igraph.Graph.Adjacency((nx.to_numpy_matrix(nxgraph) > 0).tolist())
+        index = {node: i for i, node in enumerate(nxgraph.nodes())}
+        return igraph.Graph(n=len(index), edges=[(index[u], index[v]) for u, v in nxgraph.edges()], directed=True)
 
     def make_rec_label(self, param):
         return "\n".join([str(e) for e in param])
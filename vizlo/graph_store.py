@@ -0,0 +1,269 @@
+from typing import Any, Dict, Iterator, List, Tuple
+
+import igraph
+import networkx as nx
+import numpy as np
+
+TRUNCATED = 1
+REMOVED = 2
+
+
+class _Column:
+    """
+    A growable NumPy array. values is a view of the used part, so reading it does not copy.
+    """
+
+    def __init__(self, dtype, capacity: int = 64):
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value) -> None:
+        if self._size == len(self._data):
+            self._data = np.concatenate((self._data, np.zeros_like(self._data)))
+        self._data[self._size] = value
+        self._size += 1
+
+    def __getitem__(self, index: int):
+        return self._data[index]
+
+    def __setitem__(self, index: int, value) -> None:
+        self._data[index] = value
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+
+
+class GraphStore:
+    """
+    A compact store for solving graphs. States are addressed by integer ids in the order they were added. Steps, flags
+    and the number of pruned children are kept per state, and parents, children and rule set ids are kept per edge,
+    all in NumPy arrays. Export to networkx or igraph only happens when it is asked for. Parents and children of a
+    state are looked up in an index of the edges that is built on first use and rebuilt once edges were added.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: the state all solving paths start from, e.g. INITIAL_EMPTY_SET
+        """
+        self._states: List[Any] = []
+        self._ids: Dict[Any, int] = {}
+        self._steps = _Column(np.int32)
+        self._flags = _Column(np.uint8)
+        self._pruned = _Column(np.int64)
+        self._attributes: Dict[int, Dict[str, Any]] = {}
+        self._parents = _Column(np.int64)
+        self._children = _Column(np.int64)
+        self._rule_ids = _Column(np.int32)
+        self._rules: List[Any] = []
+        self._rule_ids_by_object: Dict[int, int] = {}
+        self._removed = 0
+        self._adjacency_index: Dict[bool, Tuple[int, int, np.ndarray, np.ndarray]] = {}
+        self.add_state(root)
+
+    @classmethod
+    def from_networkx(cls, g: nx.DiGraph) -> "GraphStore":
+        """
+        Imports a graph as exported by to_networkx. Its first node is the root.
+        """
+        store = cls(next(iter(g)))
+        for node, attributes in g.nodes(data=True):
+            store.add_state(node)
+            store.add_attributes(node, attributes)
+        for parent, child, rule in g.edges(data="rule"):
+            store.add_edge(parent, child, rule)
+        return store
+
+    def __len__(self):
+        return len(self._states) - self._removed
+
+    def __contains__(self, state) -> bool:
+        return state in self._ids
+
+    def __iter__(self) -> Iterator:
+        return (state for state, flags in zip(self._states, self._flags.values) if not flags & REMOVED)
+
+    def add_state(self, state) -> int:
+        """
+        Adds a state if it is not part of the graph yet.
+        :return: the id of the state
+        """
+        state_id = self._ids.get(state)
+        if state_id is None:
+            state_id = len(self._states)
+            self._ids[state] = state_id
+            self._states.append(state)
+            self._steps.append(state.step)
+            self._flags.append(0)
+            self._pruned.append(0)
+        return state_id
+
+    def _rule_id(self, rule) -> int:
+        rule_id = self._rule_ids_by_object.get(id(rule))
+        if rule_id is None:
+            rule_id = len(self._rules)
+            self._rule_ids_by_object[id(rule)] = rule_id
+            self._rules.append(rule)
+        return rule_id
+
+    def add_edge(self, parent, child, rule) -> None:
+        """
+        Adds an edge labelled by a rule set, the child is added if it is new.
+        """
+        self._parents.append(self._ids[parent])
+        self._children.append(self.add_state(child))
+        self._rule_ids.append(self._rule_id(rule))
+
+    def truncate(self, state) -> None:
+        self._flags[self._ids[state]] |= TRUNCATED
+
+    def is_truncated(self, state) -> bool:
+        return bool(self._flags[self._ids[state]] & TRUNCATED)
+
+    def add_pruned(self, state, number: int) -> None:
+        self._pruned[self._ids[state]] += number
+
+    def pruned(self, state) -> int:
+        return int(self._pruned[self._ids[state]])
+
+    def attributes(self, state) -> Dict[str, Any]:
+        """
+        :return: the additional attributes of a state, e.g. those of an aggregate state. They can be changed in place.
+        """
+        return self._attributes.setdefault(self._ids[state], {})
+
+    def add_attributes(self, state, attributes: Dict[str, Any]) -> None:
+        """
+        Adds attributes in the form of node_attributes: "truncated" truncates the state, "pruned" is added to the number
+        of its pruned children and all others are stored as its additional attributes.
+        """
+        if attributes.get("truncated", False):
+            self.truncate(state)
+        if attributes.get("pruned", 0):
+            self.add_pruned(state, attributes["pruned"])
+        extra = {name: value for name, value in attributes.items() if name not in ("truncated", "pruned")}
+        if extra:
+            self.attributes(state).update(extra)
+
+    def has_truncated_states(self) -> bool:
+        flags = self._flags.values
+        return bool(np.any((flags & TRUNCATED != 0) & (flags & REMOVED == 0)))
+
+    def remove_states(self, states) -> None:
+        """
+        Removes states together with their edges. Their ids are not reused.
+        """
+        for state in states:
+            state_id = self._ids.pop(state)
+            self._flags[state_id] |= REMOVED
+            self._attributes.pop(state_id, None)
+            self._removed += 1
+
+    def _live_edges(self) -> np.ndarray:
+        parents, children = self._parents.values, self._children.values
+        flags = self._flags.values
+        live = ((flags[parents] | flags[children]) & REMOVED) == 0
+        # The same edge can be added by several expansions of one parent, only its first occurrence counts.
+        _, first = np.unique(parents * len(self._states) + children, return_index=True)
+        unique = np.zeros(len(parents), dtype=bool)
+        unique[first] = True
+        return live & unique
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: the parent ids, child ids and rule set ids of all edges, in the order they were added
+        """
+        live = self._live_edges()
+        return self._parents.values[live], self._children.values[live], self._rule_ids.values[live]
+
+    def number_of_edges(self) -> int:
+        return int(np.count_nonzero(self._live_edges()))
+
+    def _adjacency(self, by_child: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Groups the edges by their child or by their parent in compressed sparse row form.
+        :return: the offsets of each state id into the grouped edges, and the other end of each grouped edge
+        """
+        size = (len(self._states), len(self._parents))
+        index = self._adjacency_index.get(by_child)
+        if index is None or index[:2] != size:
+            keys, others = self._parents.values, self._children.values
+            if by_child:
+                keys, others = others, keys
+            # A stable sort keeps the edges of each state in the order they were added.
+            order = np.argsort(keys, kind="stable")
+            offsets = np.zeros(len(self._states) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=len(self._states)), out=offsets[1:])
+            index = size + (offsets, others[order])
+            self._adjacency_index[by_child] = index
+        return index[2], index[3]
+
+    def _neighbours(self, state, by_child: bool) -> List:
+        offsets, others = self._adjacency(by_child)
+        state_id = self._ids[state]
+        neighbours = others[offsets[state_id]:offsets[state_id + 1]]
+        return [self._states[i] for i in dict.fromkeys(neighbours.tolist()) if not self._flags[i] & REMOVED]
+
+    def predecessors(self, state) -> List:
+        return self._neighbours(state, by_child=True)
+
+    def successors(self, state) -> List:
+        return self._neighbours(state, by_child=False)
+
+    def state_ids(self) -> np.ndarray:
+        """
+        :return: the ids of all states that were not removed, in the order they were added
+        """
+        return np.flatnonzero((self._flags.values & REMOVED) == 0)
+
+    def state(self, state_id: int):
+        return self._states[state_id]
+
+    def rule(self, rule_id: int):
+        return self._rules[rule_id]
+
+    def node_attributes(self, state) -> Dict[str, Any]:
+        """
+        :return: a copy of all attributes of a state as to_networkx exports them, including "truncated" and "pruned"
+        """
+        return self._node_attributes(self._ids[state])
+
+    def _node_attributes(self, state_id: int) -> Dict[str, Any]:
+        attributes = dict(self._attributes.get(state_id, {}))
+        if self._flags[state_id] & TRUNCATED:
+            attributes["truncated"] = True
+        if self._pruned[state_id]:
+            attributes["pruned"] = int(self._pruned[state_id])
+        return attributes
+
+    def to_networkx(self) -> nx.DiGraph:
+        """
+        Exports the solving graph as a networkx.DiGraph whose nodes are the states and whose edges carry the
+        attribute "rule".
+        """
+        g = nx.DiGraph()
+        flags = self._flags.values
+        for state_id, state in enumerate(self._states):
+            if not flags[state_id] & REMOVED:
+                g.add_node(state, **self._node_attributes(state_id))
+        parents, children, rule_ids = self.edge_arrays()
+        g.add_edges_from((self._states[parent], self._states[child], {"rule": self._rules[rule_id]})
+                         for parent, child, rule_id in zip(parents.tolist(), children.tolist(), rule_ids.tolist()))
+        return g
+
+    def to_igraph(self) -> igraph.Graph:
+        """
+        Exports the structure of the solving graph as a directed igraph.Graph. Vertex i is the i-th live state in the
+        order of this store, the vertex attribute "step" holds its step.
+        """
+        flags = self._flags.values
+        live = (flags & REMOVED) == 0
+        vertex_ids = np.cumsum(live) - 1
+        parents, children, _ = self.edge_arrays()
+        edges = np.stack((vertex_ids[parents], vertex_ids[children]), axis=1)
+        g = igraph.Graph(n=int(np.count_nonzero(live)), edges=edges.tolist(), directed=True)
+        g.vs["step"] = self._steps.values[live].tolist()
+        return g
@@ -1,16 +1,29 @@
+import asyncio
+import functools
+import inspect
+from concurrent.futures import Executor
+
 import clingo
 from clingo import Control, Symbol, Model, SolveHandle, SolveResult, Configuration, SymbolicAtoms, TheoryAtomIter, \
     Backend, ProgramBuilder
+from vizlo.budget import Budget
+from vizlo.cache import ExpansionCache, GraphCache
+from vizlo.exploration import Exploration
 from vizlo.transform import JustTheRulesTransformer
 from vizlo.graph import NetworkxDisplay
-from vizlo.solver import SolveRunner, INITIAL_EMPTY_SET
-from typing import List, Tuple, Any, Union, Set, Collection, Dict, Optional
+from vizlo.graph_store import GraphStore
+from vizlo.solver import SolveRunner, INITIAL_EMPTY_SET, GUARD_NAME, StepIncrement, iterate_in_executor, \
+    graph_to_data, graph_store_from_data
+from typing import List, Tuple, Any, Union, Set, Collection, Dict, Optional, Iterator, AsyncIterator
 import networkx as nx
 
 # Types
 from vizlo.types import Program, ASTProgram
 from vizlo.util import log
 
+# Solver options that change how the graph is computed, but not the graph itself.
+_OPTIONS_THAT_KEEP_THE_GRAPH = ("max_workers", "expansion_cache", "checkpoint_dir", "projection")
+
 
 def program_to_string(program: Program) -> str:
     prg = ""
@@ -34,18 +47,11 @@ class PythonModel:
         return iter(self.model)
 
 
-def get_ground_universe(program: Program) -> Set[Symbol]:
-    prg = program_to_string(program)
-    ctl = Control()
-    ctl.add("base", [], prg)
-    ctl.ground([("base", [])])
-    ground_universe = set([ground_atom.symbol for ground_atom in ctl.symbolic_atoms])
-    log(f"Ground universe: {ground_universe}")
-    return ground_universe
-
-
 def extract_ground_universe_from_control(ctl: Control) -> Set[Symbol]:
-    return set([ground_atom.symbol for ground_atom in ctl.symbolic_atoms])
+    """
+    Returns all ground atoms of a grounded Control, except the step guards a SolveRunner adds to the program.
+    """
+    return set(ground_atom.symbol for ground_atom in ctl.symbolic_atoms if ground_atom.symbol.name != GUARD_NAME)
 
 
 def make_global_assumptions(universe: Set[Symbol], models: Collection[PythonModel]) -> List[Set[Tuple[Symbol, bool]]]:
@@ -77,6 +83,8 @@ class VizloControl(Control):
         self.transformer = JustTheRulesTransformer()
         self._print_changes_only = not print_entire_models
         self._atom_draw_maximum = atom_draw_maximum
+        self.expansion_cache = ExpansionCache()
+        self.graph_cache: Optional[GraphCache] = None
 
     def _set_print_only_changes(self, value: bool) -> None:
         self._print_changes_only = value
@@ -128,12 +136,13 @@ class VizloControl(Control):
         after = len(graph)
         log(f"Removed {before - after} of {before} nodes ({(before - after) / before})")
 
-    def _make_graph(self, _sort=True):
+    def _make_solve_runner(self, _sort=True, **solver_options) -> Tuple[SolveRunner, Optional[List]]:
         """
-        Ties together transformation and solving. Transforms the already added program parts and creates a solving tree.
+        Transforms the already added program parts and prepares solving.
         :param _sort: Whether the program should be sorted automatically. Setting this to false will likely result into
         wrong results!
-        :return:
+        :param solver_options: forwarded to SolveRunner, e.g. max_workers or deduplicate_states.
+        :return: the SolveRunner and the global assumption sets of the painter (None if the painter is empty).
         :raises ValueError:
         """
         if not len(self.raw_program):
@@ -141,17 +150,135 @@ class VizloControl(Control):
         else:
             t = JustTheRulesTransformer()
             program = t.transform(self.raw_program, _sort)
+        solver_options.setdefault("expansion_cache", self.expansion_cache)
+        solve_runner = SolveRunner(program, symbols_in_heads_map=t.rule2signatures, **solver_options)
+        global_assumptions = None
         if len(self.painter):
-            universe = get_ground_universe(program)
+            # The SolveRunner grounds the entire program once, so its Control already knows the universe.
+            universe = extract_ground_universe_from_control(solve_runner.control)
+            log(f"Ground universe: {universe}")
             global_assumptions = make_global_assumptions(universe, self.painter)
-            solve_runner = SolveRunner(program, t.rule2signatures)
-            g = solve_runner.make_graph(global_assumptions)
-        else:
-            solve_runner = SolveRunner(program, symbols_in_heads_map=t.rule2signatures)
-            g = solve_runner.make_graph()
+        return solve_runner, global_assumptions
+
+    def _make_graph(self, _sort=True, **solver_options):
+        """
+        Ties together transformation and solving. Transforms the already added program parts and creates a solving tree.
+        :param _sort: Whether the program should be sorted automatically. Setting this to false will likely result into
+        wrong results!
+        :param solver_options: forwarded to SolveRunner, e.g. max_workers or deduplicate_states.
+        :return: the solving graph exported to a networkx.DiGraph
+        :raises ValueError:
+        """
+        return self._make_graph_store(_sort, **solver_options).to_networkx()
+
+    def _make_graph_store(self, _sort=True, **solver_options) -> GraphStore:
+        """
+        Like _make_graph, but returns the GraphStore of the solving graph without exporting it to networkx.
+        """
+        g = self._get_cached_graph(_sort, solver_options)
+        if g is not None:
+            return g
+        solve_runner, global_assumptions = self._make_solve_runner(_sort, **solver_options)
+        g = solve_runner.make_graph(global_assumptions, store=True)
+        self._cache_graph(_sort, solver_options, g)
         return g
 
-    def paint(self, atom_draw_maximum: int = 20, show_entire_model: bool = False, sort_program: bool = True, **kwargs):
+    def _get_cached_graph(self, _sort: bool, solver_options: Dict) -> Optional[GraphStore]:
+        key = None if self.graph_cache is None else self._graph_cache_key(_sort, solver_options)
+        if key is None:
+            return None
+        data = self.graph_cache.get(key)
+        return None if data is None else graph_store_from_data(data)
+
+    def _cache_graph(self, _sort: bool, solver_options: Dict, g: GraphStore) -> None:
+        # Truncated graphs depend on timing and memory, so they are not cached.
+        if self.graph_cache is None or g.has_truncated_states():
+            return
+        key = self._graph_cache_key(_sort, solver_options)
+        if key is not None:
+            self.graph_cache.put(key, graph_to_data(g))
+
+    def _graph_cache_key(self, _sort: bool, solver_options: Dict) -> Optional[str]:
+        """
+        Creates the graph_cache key for the current program. Besides the program, the painter models and the clingo
+        version, it contains the solver options that change the graph.
+        :return: the key, or None if an exploration can't be identified across runs, see Exploration.has_stable_repr
+        """
+        painter = sorted(sorted(str(symbol) for symbol in model) for model in self.painter)
+        defaults = {name: parameter.default for name, parameter in inspect.signature(SolveRunner).parameters.items()}
+        options = {}
+        for name, value in solver_options.items():
+            # Options left at their default don't change the key, no matter whether they were passed.
+            if name in _OPTIONS_THAT_KEEP_THE_GRAPH or value == defaults.get(name):
+                continue
+            if isinstance(value, Exploration) and not value.has_stable_repr():
+                return None
+            if isinstance(value, Budget):
+                value = [value.max_models_per_solve, value.max_frontier_size, value.max_states]
+            elif value is not None and not isinstance(value, (bool, int, float, str)):
+                value = repr(value)
+            options[name] = value
+        return GraphCache.make_key(self.raw_program, _sort, painter, clingo.__version__, options)
+
+    def iter_solving(self, sort_program: bool = True, **solver_options) -> Iterator[StepIncrement]:
+        """
+        Solves the program step by step and yields the states and edges that each step adds to the solving graph as
+        soon as they are computed. If models have been added using add_to_painter, each step is solved once for all
+        painter models and only contains the solving paths that lead to one of them.
+        :param sort_program: see paint()
+        :param solver_options: forwarded to SolveRunner, e.g. max_workers or deduplicate_states.
+        :return: an iterator over StepIncrements
+        """
+        solve_runner, global_assumptions = self._make_solve_runner(sort_program, **solver_options)
+        yield from self._iter_solving(solve_runner, global_assumptions)
+
+    def explore(self, sort_program: bool = True, **solver_options) -> SolveRunner:
+        """
+        Prepares solving without expanding anything, so that partial models can be expanded on demand with
+        SolveRunner.expand, starting with INITIAL_EMPTY_SET. Painter models are not taken into account.
+        :param sort_program: see paint()
+        :param solver_options: forwarded to SolveRunner, e.g. deduplicate_states, exploration or budget. The budget
+        starts with the first expansion.
+        :return: the SolveRunner, whose graph holds the partial models expanded so far
+        :raises ValueError: if the exploration or the budget select the frontier of a step, e.g. Beam, which on-demand
+        expansion doesn't support
+        """
+        solve_runner, _ = self._make_solve_runner(sort_program, **solver_options)
+        if not solve_runner.can_expand_on_demand():
+            solve_runner.close()
+            raise ValueError("Partial models that are expanded on demand can't be selected by Beam or "
+                             "max_frontier_size.")
+        return solve_runner
+
+    @staticmethod
+    def _iter_solving(solve_runner: SolveRunner, global_assumptions: Optional[List]) -> Iterator[StepIncrement]:
+        if global_assumptions is None:
+            yield from solve_runner.iter_steps()
+            return
+        yield from solve_runner.iter_steps_for_assumption_sets(global_assumptions)
+
+    async def iter_solving_async(self, sort_program: bool = True, executor: Optional[Executor] = None,
+                                 **solver_options) -> AsyncIterator[StepIncrement]:
+        """
+        Asynchronous counterpart of iter_solving. Transformation and each solving step run in an executor, so the
+        event loop stays responsive. Cancelling the consuming task interrupts the underlying Control.
+        :param sort_program: see paint()
+        :param executor: the executor to solve in, the default executor of the event loop if None.
+        :param solver_options: forwarded to SolveRunner, e.g. max_workers or deduplicate_states.
+        :return: an asynchronous iterator over StepIncrements
+        """
+        loop = asyncio.get_event_loop()
+        solve_runner, global_assumptions = await loop.run_in_executor(
+            executor, functools.partial(self._make_solve_runner, sort_program, **solver_options))
+        increments = self._iter_solving(solve_runner, global_assumptions)
+        async for increment in iterate_in_executor(increments, solve_runner, executor):
+            yield increment
+
+    def paint(self, atom_draw_maximum: int = 20, show_entire_model: bool = False,
+              sort_program: Union[bool, str] = True,
+              max_workers: int = 1, deduplicate_states: bool = True, budget: Optional[Budget] = None,
+              exploration: Optional[Exploration] = None, aggregate_threshold: Optional[int] = None,
+              delta_states: bool = False, checkpoint_dir: Optional[str] = None, projection: bool = False, **kwargs):
         """
          Will create a graph visualization of the solving process. If models have been added using add_to_painter,
          only the solving paths that lead to these models will be drawn.
@@ -163,17 +290,78 @@ class VizloControl(Control):
          :param sort_program:
              If true, the rules of a program will be sorted and grouped by their dependencies.
              Each set of rules will contain all rules in which each atom in its heads is contained in a head.
+             If "min_frontier", ties between rule sets whose dependencies are solved are broken so that the frontier
+             stays small: integrity constraints as early and choice rules as late as possible. (default=True)
+         :param max_workers: int
+             If larger than one, the partial models of each solving step are expanded in parallel by that many
+             processes. The result is identical to the serial run. (default=1)
+         :param deduplicate_states: bool
+             If true, equivalent partial models that are reached through different parents are merged while solving
+             and only expanded once. If false, the solving tree is kept as a tree. (default=True)
+         :param budget: Budget
+             Limits on the explored search space, e.g. Budget(max_states=1000, timeout=60). If a limit is hit, the
+             partial graph is drawn and partial models that were not expanded completely are marked as truncated.
+             (default=None)
+         :param exploration: Exploration
+             Explores only part of the search space to get a representative drawing of huge search trees:
+             Beam(width, score) keeps the best partial models of each step, Sample(size, seed) keeps a seeded random
+             subset of the children of each partial model. Nodes show how many children were pruned. (default=None)
+         :param aggregate_threshold: int
+             If given, partial models with more children than this are drawn with a single aggregate child, which lists
+             the atoms that hold in all children, the atoms that hold in some children and the number of children.
+             Aggregates are not expanded any further. (default=None)
+         :param delta_states: bool
+             If true, partial models only store the atoms in which they differ from their parent and full models are
+             rebuilt when they are needed. This bounds the memory of very deep solving graphs. (default=False)
+         :param checkpoint_dir: str
+             If given, the solving graph is stored in this directory after each solving step. If solving is interrupted,
+             painting the same program again resumes after the last stored step. (default=None)
+         :param projection: bool
+             If true, the stable models are enumerated once and the graph is derived by projecting them onto each
+             solving step, which replaces one solve call per partial model. Programs with integrity constraints or other
+             rules that may eliminate partial models, unsorted programs whose rule sets use atoms that later rule sets
+             derive, as well as painter models, explorations, aggregates and budgets, are solved step by step. The
+             graph is the same either way. (default=False)
          :param kwargs:
              kwargs will be forwarded to the visualisation module. See graph.draw()
          :return:
          """
         if type(atom_draw_maximum) != int:
             raise ValueError(f"Argument atom_draw_maximum should be an integer (received {atom_draw_maximum}).")
-        g = self._make_graph(sort_program)
+        g = self._make_graph_store(sort_program, max_workers=max_workers, deduplicate_states=deduplicate_states,
+                                   budget=budget, exploration=exploration, aggregate_threshold=aggregate_threshold,
+                                   delta_states=delta_states, checkpoint_dir=checkpoint_dir, projection=projection)
         display = NetworkxDisplay(g, atom_draw_maximum, not show_entire_model)
         img = display.draw(**kwargs)
         return img
 
+    async def paint_async(self, atom_draw_maximum: int = 20, show_entire_model: bool = False,
+                          sort_program: Union[bool, str] = True, max_workers: int = 1,
+                          deduplicate_states: bool = True, budget: Optional[Budget] = None,
+                          exploration: Optional[Exploration] = None, aggregate_threshold: Optional[int] = None,
+                          delta_states: bool = False, checkpoint_dir: Optional[str] = None, projection: bool = False,
+                          executor: Optional[Executor] = None, **kwargs):
+        """
+        Asynchronous counterpart of paint, takes the same arguments. Transformation and solving run in an executor, so
+        the event loop stays responsive. If the awaiting task is cancelled, the underlying Control is interrupted and
+        asyncio.CancelledError is raised.
+        :param executor: the executor to solve in, the default executor of the event loop if None.
+        """
+        if type(atom_draw_maximum) != int:
+            raise ValueError(f"Argument atom_draw_maximum should be an integer (received {atom_draw_maximum}).")
+        loop = asyncio.get_event_loop()
+        solver_options = dict(max_workers=max_workers, deduplicate_states=deduplicate_states, budget=budget,
+                              exploration=exploration, aggregate_threshold=aggregate_threshold,
+                              delta_states=delta_states, checkpoint_dir=checkpoint_dir, projection=projection)
+        g = await loop.run_in_executor(executor, self._get_cached_graph, sort_program, solver_options)
+        if g is None:
+            solve_runner, global_assumptions = await loop.run_in_executor(
+                executor, functools.partial(self._make_solve_runner, sort_program, **solver_options))
+            g = await solve_runner.make_graph_async(global_assumptions, executor, store=True)
+            await loop.run_in_executor(executor, self._cache_graph, sort_program, solver_options, g)
+        display = NetworkxDisplay(g, atom_draw_maximum, not show_entire_model)
+        return display.draw(**kwargs)
+
     def _add_and_ground(self, prg):
         """Short cut for complex add and ground calls, should only be used for debugging purposes."""
         self.add("base", [], prg)
@@ -1,26 +1,132 @@
-from typing import List, Set, Union, Tuple, Collection
+import asyncio
+import hashlib
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Set, Tuple, Collection, Dict, Optional, Any, Iterable, FrozenSet, NamedTuple, Iterator, \
+    AsyncIterator, Union
 
 import clingo
 import networkx as nx
+import numpy as np
 
 from clingo import Control, Symbol
 
-from vizlo.types import ASTRuleSet, FlatASTProgram, ASTProgram
+from vizlo.budget import Budget
+from vizlo.cache import ExpansionCache, GraphCache, LRUCache
+from vizlo.exploration import Exploration
+from vizlo.graph_store import GraphStore
+from vizlo.transform import can_eliminate_models, guard_rule_set, parse_rule_set, signatures_of
+from vizlo.types import ASTRuleSet, ASTProgram
+from vizlo import util
 from vizlo.util import log
 
 EMERGENCY_EXIT_COUNTER = 0
+GUARD_NAME = "__vizlo_step"
 
 
-def get_all_trues_from_assumption(assumptions: Collection[Tuple[Symbol, bool]]) -> Set[Symbol]:
-    return set(atom for atom, is_true in assumptions if is_true)
+def signature_of(atom) -> Optional[Tuple[str, int]]:
+    if isinstance(atom, Symbol) and atom.type == clingo.SymbolType.Function:
+        return atom.name, len(atom.arguments)
+    return None
+
+
+def index_by_signature(assumptions: Collection[Tuple[Symbol, bool]]) -> Dict[Tuple[str, int], List[Tuple[Symbol, bool]]]:
+    """
+    Groups assumptions by the signature of their atoms, so that the assumptions relevant for a rule set can be fetched
+    without testing every assumption against every signature.
+    :param assumptions: a collection of Symbols and whether they are globally considered true or false
+    :return: a mapping from a signature (name, arity) to the assumptions with that signature
+    """
+    index = {}
+    for assumption in assumptions:
+        signature = signature_of(assumption[0])
+        if signature is not None:
+            index.setdefault(signature, []).append(assumption)
+    return index
+
+
+class AtomTable:
+    """
+    Interns atoms by mapping each of them to a small integer, so that sets of atoms can be stored as bitsets.
+    """
+    __slots__ = ("_ids", "_atoms", "_signature_ids")
+
+    def __init__(self):
+        self._ids: Dict[Any, int] = {}
+        self._atoms: List[Any] = []
+        self._signature_ids: Dict[Tuple[str, int], List[int]] = {}
+
+    def __len__(self):
+        return len(self._atoms)
+
+    def id_of(self, atom) -> int:
+        atom_id = self._ids.get(atom)
+        if atom_id is None:
+            atom_id = len(self._atoms)
+            self._ids[atom] = atom_id
+            self._atoms.append(atom)
+            signature = signature_of(atom)
+            if signature is not None:
+                self._signature_ids.setdefault(signature, []).append(atom_id)
+        return atom_id
+
+    def signature_mask(self, signatures: Collection[Tuple[str, int]]) -> int:
+        """
+        :param signatures: a collection of signatures (name, arity)
+        :return: a bitset of all atoms known so far that match one of the signatures
+        """
+        ids = [atom_id for signature in signatures for atom_id in self._signature_ids.get(signature, ())]
+        return self._ids_to_bits(ids)
+
+    def encode(self, atoms: Iterable) -> int:
+        """
+        :param atoms: a collection of atoms, usually clingo.Symbols
+        :return: a bitset in which bit i is set iff the atom with id i is contained in atoms
+        """
+        return self._ids_to_bits([self.id_of(atom) for atom in atoms])
+
+    @staticmethod
+    def _ids_to_bits(ids: List[int]) -> int:
+        if len(ids) == 0:
+            return 0
+        buffer = bytearray((max(ids) >> 3) + 1)
+        for atom_id in ids:
+            buffer[atom_id >> 3] |= 1 << (atom_id & 7)
+        return int.from_bytes(buffer, "little")
+
+    def atom(self, atom_id: int):
+        return self._atoms[atom_id]
+
+    def decode(self, bits: int) -> FrozenSet:
+        """
+        :param bits: a bitset as created by encode
+        :return: the atoms whose bits are set
+        """
+        return frozenset(self._atoms[i] for i in self.ids(bits))
+
+    @staticmethod
+    def ids(bits: int) -> List[int]:
+        """
+        :param bits: a bitset as created by encode
+        :return: the ids whose bits are set
+        """
+        return [i for i, bit in enumerate(bin(bits)[:1:-1]) if bit == "1"]
+
+
+ATOMS = AtomTable()
 
 
 class SolverState:
     """
     Represents a single solver state that is created during execution.
+    The sets of atoms are stored as bitsets over the ids of an AtomTable and decoded when they are accessed.
     """
+    __slots__ = ("_model", "_falses", "_adds", "step", "is_still_active", "_atoms")
 
-    def __init__(self, model: Set, is_still_active, step: int = -1, falses=None, adds=None):
+    def __init__(self, model: Set, is_still_active, step: int = -1, falses=None, adds=None, atoms: AtomTable = None):
         """
         Initializer
         :param model: a Set of clingo.Symbol that are know to be true in this step.
@@ -28,32 +134,170 @@ class SolverState:
         :param step: the iterative solver step it was generated
         :param falses: a Set of clingo.Symbol that are know to be false in this step.
         :param adds: a Set of clingo.Symbol that were added to the partial model in this step.
+        :param atoms: the AtomTable used to encode the sets, usually the one of the SolveRunner.
         """
-        if adds is None:
-            adds = set()
-        if falses is None:
-            falses = set()
-        if isinstance(model, list):
-            model = set(model)
-        self.model: Set = model
+        if atoms is None:
+            atoms = ATOMS
+        self._atoms: AtomTable = atoms
+        self._model: int = atoms.encode(model or ())
         self.step: int = step
-        self.falses: Set = falses
+        self._falses: int = atoms.encode(falses or ())
         self.is_still_active: bool = is_still_active
-        self.adds: Union[Set, None] = adds
+        self._adds: int = atoms.encode(adds or ())
+
+    @classmethod
+    def from_bits(cls, model: int, is_still_active, step: int, falses: int, adds: int, atoms: AtomTable):
+        state = cls.__new__(cls)
+        state._atoms = atoms
+        state._model = model
+        state.step = step
+        state._falses = falses
+        state.is_still_active = is_still_active
+        state._adds = adds
+        return state
+
+    @property
+    def model(self) -> FrozenSet:
+        return self._atoms.decode(self._model)
+
+    @model.setter
+    def model(self, value: Collection):
+        self._model = self._atoms.encode(value)
+
+    @property
+    def falses(self) -> FrozenSet:
+        return self._atoms.decode(self._falses)
+
+    @falses.setter
+    def falses(self, value: Collection):
+        self._falses = self._atoms.encode(value)
+
+    @property
+    def adds(self) -> FrozenSet:
+        return self._atoms.decode(self._adds)
+
+    @adds.setter
+    def adds(self, value: Collection):
+        self._adds = self._atoms.encode(value)
 
     def __repr__(self):
-        return f"{self.model}"
+        return f"{set(self.model)}"
 
     def __eq__(self, other):
         if isinstance(other, SolverState):
+            if self._atoms is other._atoms:
+                return self._model == other._model and self.step == other.step
             return self.model == other.model and self.step == other.step
         return False
 
     def __hash__(self):
         return id(self)
 
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self._model) + sys.getsizeof(self._falses) + \
+               sys.getsizeof(self._adds)
+
     def is_still_a_candidate(self) -> bool:
-        return self.step == 0 or len(self.model) > 0
+        return self.step == 0 or self._model != 0
+
+
+class DeltaSolverState(SolverState):
+    """
+    A SolverState that only stores how its model and falses differ from those of its parent in the solving graph.
+    Small differences are kept as arrays of atom ids, so a state occupies memory in proportion to the atoms it changes
+    and not to the largest atom id. The full bitsets are rebuilt along the parent pointers when they are needed and
+    kept in a shared LRUCache, so memory no longer grows with the size of the models times the number of states.
+    """
+    __slots__ = ("_parent", "_model_delta", "_falses_delta", "_adds_delta", "_materialised")
+
+    @classmethod
+    def from_state(cls, state: SolverState, parent: SolverState, materialised: LRUCache) -> "DeltaSolverState":
+        """
+        :param state: the SolverState to encode
+        :param parent: the SolverState state was expanded from
+        :param materialised: the cache for rebuilt bitsets, shared by all states of a graph
+        """
+        delta = cls.__new__(cls)
+        delta._atoms = state._atoms
+        delta.step = state.step
+        delta.is_still_active = state.is_still_active
+        delta._adds = state._adds
+        delta._parent = parent
+        delta._model_delta = _delta(state._model ^ parent._model)
+        delta._falses_delta = _delta(state._falses ^ parent._falses)
+        delta._materialised = materialised
+        return delta
+
+    def _materialise(self) -> Tuple[int, int]:
+        bits = self._materialised.get(self)
+        if bits is not None:
+            return bits
+        # Walk up to the closest ancestor whose bitsets are known and rebuild the states below it.
+        chain = []
+        state = self
+        while isinstance(state, DeltaSolverState) and bits is None:
+            chain.append(state)
+            state = state._parent
+            if isinstance(state, DeltaSolverState):
+                bits = state._materialised.get(state)
+        if bits is None:
+            bits = state._model, state._falses
+        for state in reversed(chain):
+            bits = (bits[0] ^ _delta_bits(state._model_delta),
+                    bits[1] ^ _delta_bits(state._falses_delta))
+            state._materialised.put(state, bits)
+        return bits
+
+    @property
+    def _model(self) -> int:
+        return self._materialise()[0]
+
+    @_model.setter
+    def _model(self, value: int):
+        self._model_delta = _delta(value ^ self._parent._model)
+        self._materialised.put(self, (value, self._falses))
+
+    @property
+    def _falses(self) -> int:
+        return self._materialise()[1]
+
+    @_falses.setter
+    def _falses(self, value: int):
+        self._falses_delta = _delta(value ^ self._parent._falses)
+        self._materialised.put(self, (self._model, value))
+
+    @property
+    def _adds(self) -> int:
+        return _delta_bits(self._adds_delta)
+
+    @_adds.setter
+    def _adds(self, value: int):
+        self._adds_delta = _delta(value)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self._model_delta) + sys.getsizeof(self._falses_delta) + \
+               sys.getsizeof(self._adds_delta)
+
+
+def _delta(bits: int) -> Union[int, array]:
+    """
+    :param bits: a bitset as created by AtomTable.encode
+    :return: the ids whose bits are set as an array, or the bitset itself if that is smaller
+    """
+    ids = array("i", AtomTable.ids(bits))
+    if sys.getsizeof(ids) < sys.getsizeof(bits):
+        return ids
+    return bits
+
+
+def _delta_bits(delta: Union[int, array]) -> int:
+    """
+    :param delta: a difference as created by _delta
+    :return: the difference as a bitset
+    """
+    if isinstance(delta, int):
+        return delta
+    return AtomTable._ids_to_bits(delta)
 
 
 class SolveWorker:
@@ -61,11 +305,10 @@ class SolveWorker:
     Object that is concerned with creating new SolverStates to be added to the graph.
     """
 
-    def __init__(self, main, ctl: clingo.Control, rule: ASTRuleSet, symbols_in_heads=None):
+    def __init__(self, main, rule: ASTRuleSet, symbols_in_heads=None):
         """
         Should contain only information concerned with one rule set.
         :param main:
-        :param ctl:
         :param rule:
         :param symbols_in_heads:
         :param fixed_assumptions:
@@ -73,148 +316,1204 @@ class SolveWorker:
         if symbols_in_heads is None:
             symbols_in_heads = set()
         self.main = main
-        self.ctl = ctl
         self.rule = rule
         self.singatures_in_heads = symbols_in_heads
 
-    @staticmethod
-    def _filter_relevant_assumptions(global_assumptions: Collection[Tuple[Symbol, bool]],
-                                     signatures_of_heads: Collection[Tuple[str, int]]):
+    def run(self, i, global_assumptions, assumption_index=None):
         """
-        Returns a partial set of the global assumptions that only contains those assumptions that the head depends on
+        Expands all active partial models of step i with this rule set.
+        :param i: the step
         :param global_assumptions: a collection of Symbols and whether they are globally considered true or false
-        :param signatures_of_heads: a collection of signatures (name, arity)
-        :return: a partial set of the global_assumptions that matched
+        :param assumption_index: global_assumptions indexed by signature, see index_by_signature. Computed if missing.
         """
-        result = [glob for glob in global_assumptions if
-                  any(glob[0].match(name, arity) for name, arity in signatures_of_heads)]
-        # print(f"{global_assumptions}, {signatures_of_heads} -> {result}")
-        return result
-
-    def run(self, i, global_assumptions):
         # analytically find recursive components and add them at once
+        self.main.activate_prefix(i)
         partial_models = self.main.find_active_nodes_at_time_step(i)
         log(f"{self.rule} with {len(partial_models)} previous partial models.")
-        for partial_model in partial_models:
+        if assumption_index is None:
+            assumption_index = index_by_signature(global_assumptions)
+        relevant_assumptions = self.relevant_assumptions(assumption_index)
+        self.expand(i, [(partial_model, relevant_assumptions) for partial_model in partial_models])
+
+    def relevant_assumptions(self, assumption_index: Dict[Tuple[str, int], List[Tuple[Symbol, bool]]]) \
+            -> List[Tuple[Symbol, bool]]:
+        """
+        :param assumption_index: global assumptions indexed by signature, see index_by_signature
+        :return: the global assumptions about atoms that the heads of this rule set may derive
+        """
+        return [assumption for signature in self.singatures_in_heads
+                for assumption in assumption_index.get(signature, ())]
+
+    def expand(self, i, jobs: List[Tuple[SolverState, List[Tuple[Symbol, bool]]]],
+               share_siblings: bool = False) -> List[List[SolverState]]:
+        """
+        Expands partial models of step i with this rule set and adds their children to the solving graph. The prefix
+        of step i has to be active.
+        :param i: the step
+        :param jobs: the partial models, each with the global assumptions that are relevant for this rule set
+        :param share_siblings: if true, several jobs for the same partial model share their equivalent children, even if
+        the SolveRunner does not deduplicate states
+        :return: the children added for each job, empty for jobs that were not expanded
+        """
+        atoms = self.main.atoms
+        heads_mask = atoms.signature_mask(self.singatures_in_heads)
+        encoded = {}
+        trues_per_model = []
+        falses_per_model = []
+        assumptions_per_model = []
+        for partial_model, relevant_assumptions in jobs:
             # print(f"Continuing with {partial_model}")
-            assumptions = self._create_true_symbols_from_solver_state(partial_model)
-            relevant_assumptions = self._filter_relevant_assumptions(global_assumptions, self.singatures_in_heads)
-            assumptions.extend(relevant_assumptions)
-            log(f"Assumptions: {assumptions}, model: {partial_model}")
-            new_partial_models = self._get_new_partial_models(assumptions, self.ctl, i)
-            _consolidate_new_solver_states(assumptions, new_partial_models)
-            self.main.update_graph(partial_model, self.rule, new_partial_models)
-
-    def _get_new_partial_models(self, assumptions, ctl, i):
-        solver_states_to_create = []
+            if id(relevant_assumptions) not in encoded:
+                encoded[id(relevant_assumptions)] = (
+                    atoms.encode(atom for atom, value in relevant_assumptions if value),
+                    atoms.encode(atom for atom, value in relevant_assumptions if not value))
+            relevant_trues, relevant_falses = encoded[id(relevant_assumptions)]
+            trues = partial_model._model | relevant_trues
+            falses = (partial_model._falses & ~heads_mask) | relevant_falses
+            assumptions = self.main.make_assumptions(trues, falses)
+            if util.DEBUG:
+                # Printing a partial model decodes it, which is too slow to do for every job unless debugging.
+                log(f"Assumptions: {assumptions}, model: {partial_model}")
+            trues_per_model.append(trues)
+            falses_per_model.append(falses)
+            assumptions_per_model.append(assumptions)
+        max_models = None if self.main.budget is None else self.main.budget.max_models_per_solve
+        aggregate_threshold = self.main.aggregate_threshold
+        if aggregate_threshold is not None and (max_models is None or max_models > aggregate_threshold):
+            # One more model than the threshold tells whether the partial model has to be aggregated.
+            max_models = aggregate_threshold + 1
+        else:
+            aggregate_threshold = None
+        if self.main.max_workers > 1 and len(jobs) > 1:
+            results = self.main.solve_in_parallel(i, assumptions_per_model, max_models)
+        else:
+            results = (self.main.solve(i, assumptions, max_models) for assumptions in assumptions_per_model)
+        children = [[] for _ in jobs]
+        siblings = {} if share_siblings and not self.main.deduplicate_states else None
+        for index, ((partial_model, _), trues, falses, (models, complete)) in enumerate(zip(jobs, trues_per_model,
+                                                                                          falses_per_model,
+                                                                                          results)):
+            if aggregate_threshold is not None and len(models) > aggregate_threshold:
+                aggregate = self.main.aggregate(partial_model, self.rule, i, assumptions_per_model[index], trues,
+                                                falses)
+                children[index] = [] if aggregate is None else [aggregate]
+                if aggregate is not None:
+                    self.main.expanded.add(partial_model)
+            elif complete or len(models):
+                if not complete:
+                    self.main.truncate([partial_model])
+                encoded_models = [atoms.encode(model) for model in models]
+                if util.DEBUG:
+                    self.main.count_duplicates(encoded_models)
+                new_partial_models = _make_solver_states_from_bits(encoded_models, trues, i, atoms)
+                _consolidate_new_solver_states(falses, new_partial_models)
+                kept = self.main.exploration.select_children(new_partial_models)
+                self.main.count_pruned(partial_model, len(new_partial_models) - len(kept))
+                if self.main.delta_states:
+                    kept = [DeltaSolverState.from_state(state, partial_model, self.main.materialised)
+                            for state in kept]
+                table = None if siblings is None else siblings.setdefault(partial_model, {})
+                new_partial_models = self.main.intern_states(kept, table)
+                self.main.update_graph(partial_model, self.rule, new_partial_models)
+                self.main.expanded.add(partial_model)
+                children[index] = new_partial_models
+            else:
+                self.main.truncate([partial_model])
+            if self.main.is_budget_exhausted():
+                self.main.truncate([partial_model for partial_model, _ in jobs[index + 1:]])
+                break
+        return children
+
+
+def _solve_for_models(ctl: Control, assumptions: Collection[Tuple[Symbol, bool]],
+                      max_models: Optional[int] = None) -> Tuple[List[Set[Symbol]], bool]:
+    """
+    Enumerates the models of the currently active prefix under the given assumptions.
+    :param ctl: a grounded Control
+    :param assumptions: a collection of Symbols and whether they should be true or false
+    :param max_models: if given, enumeration stops after that many models.
+    :return: a list of models, each as a Set of the Symbols that are true, and whether the enumeration was complete,
+    i.e. it neither hit max_models nor was it interrupted.
+    """
+    models = []
+    with ctl.solve(assumptions=assumptions, yield_=True) as handle:
+        for m in handle:
+            models.append(set(symbol for symbol in m.symbols(atoms=True) if symbol.name != GUARD_NAME))
+            if max_models is not None and len(models) >= max_models:
+                return models, False
+        handle.wait()
+        result = handle.get()
+    return models, not result.interrupted
+
+
+def _solve_for_consequences(ctl: Control, assumptions: Collection, enum_mode: str) -> Tuple[Set[Symbol], bool]:
+    """
+    Computes the brave or cautious consequences of the currently active prefix under the given assumptions.
+    :param enum_mode: "brave" or "cautious"
+    :return: the consequences and whether their computation was complete, i.e. not interrupted.
+    """
+    consequences = set()
+    ctl.configuration.solve.enum_mode = enum_mode
+    try:
         with ctl.solve(assumptions=assumptions, yield_=True) as handle:
-            hacky_counter = 0
             for m in handle:
-                model = set(m.symbols(atoms=True))
-                adds = model - get_all_trues_from_assumption(assumptions)
-                syms = SolverState(m.symbols(atoms=True), True, i + 1, adds=adds)
-                solver_states_to_create.append(syms)
-                hacky_counter += 1
-            if hacky_counter == 0:
-                # HACK: This means the candidate model became conflicting.
-                solver_states_to_create.append(SolverState(set(), False, i + 1))
-            handle.wait()
-            handle.get()
-        return solver_states_to_create
-
-    def _create_true_symbols_from_solver_state(self, s):
-        syms = []
-        for true in s.model:
-            syms.append((true, True))
-        for false in s.falses:
-            if not any((false.match(s[0], s[1]) for s in self.singatures_in_heads)):
-                syms.append((false, False))
-        return syms
-
-
-def _update_falses_in_solver_states(sss):
-    all_possible = set()
+                consequences = set(symbol for symbol in m.symbols(atoms=True) if symbol.name != GUARD_NAME)
+            result = handle.get()
+    finally:
+        ctl.configuration.solve.enum_mode = "auto"
+    return consequences, not result.interrupted
+
+
+def _count_models(ctl: Control, assumptions: Collection, limit: int) -> Tuple[int, bool]:
+    """
+    Counts the models of the currently active prefix under the given assumptions without looking at their atoms.
+    :param limit: counting stops after that many models.
+    :return: the number of models and whether it is exact, i.e. counting neither hit the limit nor was interrupted.
+    """
+    count = 0
+    with ctl.solve(assumptions=assumptions, yield_=True) as handle:
+        for _ in handle:
+            count += 1
+            if count > limit:
+                return limit, False
+        result = handle.get()
+    return count, not result.interrupted
+
+
+def _make_solver_states_from_bits(models: List[int], trues: int, i: int, atoms: AtomTable) -> List[SolverState]:
+    """
+    Creates the SolverStates for the models that were found when expanding a partial model at step i.
+    Siblings are ordered by what they add, so that the result does not depend on clingo's enumeration order.
+    :param models: the models as bitsets, see AtomTable.encode
+    :param trues: a bitset of the atoms that were assumed to be true
+    """
+    if len(models) == 0:
+        # HACK: This means the candidate model became conflicting.
+        return [SolverState.from_bits(0, False, i + 1, 0, 0, atoms)]
+    adds = [model & ~trues for model in models]
+    return [SolverState.from_bits(models[j], True, i + 1, 0, adds[j], atoms) for j in _order_siblings(adds, atoms)]
+
+
+def _order_siblings(adds: List[int], atoms: AtomTable) -> List[int]:
+    """
+    Orders siblings by the number of atoms they add and then by the sorted string forms of these atoms.
+    The adds are unpacked into a boolean siblings x atoms matrix whose columns are the added atoms sorted by their
+    string forms. Comparing the sorted string lists of two siblings with the same number of adds then amounts to
+    comparing their rows, where the first differing column that is set comes first. So the order is computed by a
+    single np.lexsort and every atom is converted to a string once instead of once per sibling.
+    :param adds: a bitset of the added atoms of each sibling
+    :return: the indices of the siblings in their order
+    """
+    union = 0
+    for added in adds:
+        union |= added
+    if union == 0:
+        return list(range(len(adds)))
+    # Atoms of late rule sets have large ids, so only the band of bytes from the lowest to the highest added atom is
+    # packed, and only the bytes in it that contain added atoms are unpacked.
+    first_byte = ((union & -union).bit_length() - 1) >> 3
+    shift = 8 * first_byte
+    columns = np.array(AtomTable.ids(union >> shift), dtype=np.int64) + shift
+    number_of_bytes = int(columns[-1] >> 3) - first_byte + 1
+    packed = np.frombuffer(b"".join((added >> shift).to_bytes(number_of_bytes, "little") for added in adds),
+                           dtype=np.uint8)
+    packed = packed.reshape(len(adds), number_of_bytes)
+    byte_columns = np.unique(columns >> 3) - first_byte
+    bits = np.unpackbits(packed[:, byte_columns], axis=1, bitorder="little")
+    by_name = sorted(range(len(columns)), key=lambda column: str(atoms.atom(int(columns[column]))))
+    columns = columns[by_name]
+    matrix = bits[:, np.searchsorted(byte_columns, (columns >> 3) - first_byte) * 8 + (columns & 7)].astype(bool)
+    # np.lexsort sorts by its last key first.
+    keys = [~matrix[:, column] for column in range(len(columns) - 1, -1, -1)]
+    keys.append(matrix.sum(axis=1))
+    return np.lexsort(keys).tolist()
+
+
+def _update_falses_in_solver_states(sss: List[SolverState]):
+    all_possible = 0
     for s in sss:
-        all_possible.update(s.model)
+        all_possible |= s._model
     for s in sss:
-        falses = all_possible - set(s.model)
-        s.falses = falses
+        s._falses = all_possible & ~s._model
 
 
-def _assert_falses_from_assumptions(syms: List[SolverState], assumpts):
+def _assert_falses_from_assumptions(syms: List[SolverState], falses: int):
     for sym in syms:
-        for atom, value in assumpts:
-            if not value:
-                sym.falses.add(atom)
+        sym._falses |= falses
 
 
-def _consolidate_new_solver_states(assumpts, solver_states_to_create):
+def _consolidate_new_solver_states(falses: int, solver_states_to_create):
+    """
+    :param falses: a bitset of the atoms that were assumed to be false
+    :param solver_states_to_create: the siblings created by one expansion
+    """
     _update_falses_in_solver_states(solver_states_to_create)
-    _assert_falses_from_assumptions(solver_states_to_create, assumpts)
+    _assert_falses_from_assumptions(solver_states_to_create, falses)
+
 
+def make_guard(step: int) -> Symbol:
+    return clingo.Function(GUARD_NAME, [clingo.Number(step)])
 
-def _make_new_control_and_ground(current_prg: FlatASTProgram) -> Control:
-    prg_as_str = " ".join([str(rule) for rule in current_prg])
+
+def _make_guarded_program(program: ASTProgram) -> str:
+    """
+    Guards each rule set by an external atom, so that solving can be restricted to any prefix of the program by
+    assigning the externals (see SolveRunner.activate_prefix).
+    :param program: the (sorted) ASTProgram
+    :return: the guarded program as a string
+    """
+    prg = []
+    for i, rule_set in enumerate(program):
+        guard = str(make_guard(i))
+        prg.append(f"#external {guard}.")
+        prg.extend(guard_rule_set(rule_set, guard))
+    return "\n".join(prg)
+
+
+def _ground_guarded_program(guarded_program: str) -> Control:
     ctl = clingo.Control(["0"])
-    ctl.add("base", [], prg_as_str)
+    ctl.add("base", [], guarded_program)
     ctl.ground([("base", [])])
     return ctl
 
 
+def _assign_guards(ctl: Control, active_prefix: int, step: int) -> int:
+    """
+    Assigns the guards of ctl so that only the rule sets up to and including step are active.
+    Only the guards between the previously and the newly active prefix are touched.
+    :return: the new active prefix
+    """
+    if step > active_prefix:
+        for i in range(active_prefix + 1, step + 1):
+            ctl.assign_external(make_guard(i), True)
+    else:
+        for i in range(step + 1, active_prefix + 1):
+            ctl.assign_external(make_guard(i), False)
+    return step
+
+
+# Each process of the pool used by SolveRunner.solve_in_parallel grounds its own copy of the guarded program.
+_process_control: Optional[Control] = None
+_process_active_prefix = -1
+
+
+def _init_process_control(guarded_program: str) -> None:
+    global _process_control, _process_active_prefix
+    _process_control = _ground_guarded_program(guarded_program)
+    _process_active_prefix = -1
+
+
+def _solve_slice_in_process(step: int, max_models: Optional[int], timeout: Optional[float],
+                            assumption_slice: List[List[Tuple[str, bool]]]) -> List[Tuple[List[List[str]], bool]]:
+    """
+    Runs in a pool process. Symbols are passed as strings, as they are not guaranteed to be picklable.
+    """
+    global _process_active_prefix
+    _process_active_prefix = _assign_guards(_process_control, _process_active_prefix, step)
+    deadline = None
+    timer = None
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+        timer = threading.Timer(timeout, _process_control.interrupt)
+        timer.start()
+    result = []
+    try:
+        for assumptions in assumption_slice:
+            if deadline is not None and time.monotonic() >= deadline:
+                result.append(([], False))
+                continue
+            parsed = [assumption if isinstance(assumption, int) else (clingo.parse_term(assumption[0]), assumption[1])
+                      for assumption in assumptions]
+            models, complete = _solve_for_models(_process_control, parsed, max_models)
+            result.append(([[str(atom) for atom in model] for model in models], complete))
+    finally:
+        if timer is not None:
+            timer.cancel()
+    return result
+
+
+def _graph_to_lists(g: GraphStore) -> Tuple[List, List, List]:
+    node_indices = {}
+    nodes = []
+    for i, state_id in enumerate(g.state_ids().tolist()):
+        node_indices[state_id] = i
+        state = g.state(state_id)
+        nodes.append(_state_to_list(state, g.node_attributes(state)))
+    rule_sets = []
+    rule_indices = {}
+    edges = []
+    for parent, child, rule_id in zip(*(ids.tolist() for ids in g.edge_arrays())):
+        if rule_id not in rule_indices:
+            rule_indices[rule_id] = len(rule_sets)
+            rule_sets.append([str(ast_rule) for ast_rule in g.rule(rule_id)])
+        edges.append((node_indices[parent], node_indices[child], rule_indices[rule_id]))
+    return rule_sets, nodes, edges
+
+
+def _state_to_list(state: SolverState, attributes: Dict) -> Tuple:
+    return (state.step, [str(atom) for atom in state.model], [str(atom) for atom in state.falses],
+            [str(atom) for atom in state.adds], state.is_still_active, attributes.get("truncated", False),
+            attributes.get("pruned", 0), _aggregate_to_lists(attributes))
+
+
+def _state_from_list(node: List, atoms: AtomTable) -> Tuple[SolverState, Dict]:
+    """
+    Recreates a SolverState and its node attributes from the list of _state_to_list.
+    """
+    parse = lambda symbols: set(clingo.parse_term(symbol) for symbol in symbols)
+    step, model, falses, adds, is_still_active, is_truncated, pruned, aggregate = node
+    state = SolverState(parse(model), is_still_active, step, falses=parse(falses), adds=parse(adds), atoms=atoms)
+    attributes = {"truncated": is_truncated}
+    if pruned:
+        attributes["pruned"] = pruned
+    if aggregate is not None:
+        sometimes, model_count, model_count_is_exact = aggregate
+        attributes.update(sometimes=parse(sometimes), model_count=model_count,
+                          model_count_is_exact=model_count_is_exact)
+    return state, attributes
+
+
+def _aggregate_to_lists(attributes: Dict) -> Optional[Tuple[List[str], int, bool]]:
+    if "model_count" not in attributes:
+        return None
+    return [str(atom) for atom in attributes["sometimes"]], attributes["model_count"], \
+        attributes["model_count_is_exact"]
+
+
+def _graph_from_lists(nodes: List, edges: List, rule_sets: List[ASTRuleSet], atoms: AtomTable) -> GraphStore:
+    """
+    Recreates a solving graph from the lists of _graph_to_lists. The first node is the root, it is replaced by
+    INITIAL_EMPTY_SET. All other states are kept apart, even equal ones, so trees stay trees.
+    """
+    states = [INITIAL_EMPTY_SET]
+    g = GraphStore(INITIAL_EMPTY_SET)
+    for i, node in enumerate(nodes):
+        state, attributes = _state_from_list(node, atoms)
+        if i == 0:
+            state = INITIAL_EMPTY_SET
+        else:
+            states.append(state)
+            g.add_state(state)
+        g.add_attributes(state, attributes)
+    for u, v, rule_index in edges:
+        g.add_edge(states[u], states[v], rule_sets[rule_index])
+    return g
+
+
+def graph_to_data(g: Union[nx.DiGraph, GraphStore]) -> Dict[str, List]:
+    """
+    Serialises a solving graph into lists of strings and numbers, e.g. to store it in a GraphCache.
+    :param g: the solving graph, either a GraphStore or its networkx export
+    :return: a JSON serialisable dictionary, see graph_from_data
+    """
+    if isinstance(g, nx.DiGraph):
+        g = GraphStore.from_networkx(g)
+    rule_sets, nodes, edges = _graph_to_lists(g)
+    return {"rule_sets": rule_sets, "nodes": nodes, "edges": edges}
+
+
+def graph_store_from_data(data: Dict[str, List]) -> GraphStore:
+    """
+    Recreates a solving graph serialised by graph_to_data as a GraphStore. Its root is INITIAL_EMPTY_SET.
+    """
+    rule_sets = [parse_rule_set(rule_set) for rule_set in data["rule_sets"]]
+    return _graph_from_lists(data["nodes"], data["edges"], rule_sets, AtomTable())
+
+
+def graph_from_data(data: Dict[str, List]) -> nx.DiGraph:
+    """
+    Recreates a solving graph serialised by graph_to_data. Its root is INITIAL_EMPTY_SET.
+    """
+    return graph_store_from_data(data).to_networkx()
+
+
+def _state_key(state: SolverState) -> Tuple:
+    return state.step, state._model, state._falses, state.is_still_active
+
+
+def _state_hash(state: SolverState) -> Tuple:
+    # Unlike _state_key, this does not keep the bitsets alive, which matters for DeltaSolverStates.
+    return state.step, hash(state._model), hash(state._falses), state.is_still_active
+
+
+def _split_into_slices(items: List, number_of_slices: int) -> List[List]:
+    size, rest = divmod(len(items), number_of_slices)
+    slices = []
+    begin = 0
+    for i in range(number_of_slices):
+        end = begin + size + (1 if i < rest else 0)
+        if end > begin:
+            slices.append(items[begin:end])
+        begin = end
+    return slices
+
+
+def _advance(iterator: Iterator, solve_runner: "SolveRunner") -> Tuple[bool, Any]:
+    """
+    Computes the next item of an iterator in an executor thread. If solving was cancelled meanwhile, the iterator is
+    closed in the same thread, so that the SolveRunner releases its resources once the interrupted step returned.
+    :return: whether an item was computed and the item
+    """
+    try:
+        item = next(iterator)
+    except StopIteration:
+        return False, None
+    if solve_runner.cancelled:
+        iterator.close()
+        return False, None
+    return True, item
+
+
+async def iterate_in_executor(iterator: Iterator, solve_runner: "SolveRunner",
+                              executor: Optional[Executor] = None) -> AsyncIterator:
+    """
+    Turns an iterator that solves with solve_runner into an asynchronous iterator. Each item is computed in the
+    executor, if the consuming task is cancelled while an item is computed, solve_runner is cancelled.
+    :param iterator: e.g. SolveRunner.iter_steps()
+    :param solve_runner: the SolveRunner the iterator solves with
+    :param executor: the executor to compute the items in, the default executor of the event loop if None.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            has_item, item = await loop.run_in_executor(executor, _advance, iterator, solve_runner)
+            if not has_item:
+                return
+            yield item
+    except asyncio.CancelledError:
+        solve_runner.cancel()
+        raise
+    except GeneratorExit:
+        iterator.close()
+        raise
+
+
+class StepIncrement(NamedTuple):
+    """
+    The part of the solving graph that was created by solving a single step.
+    """
+    step: int
+    rule: ASTRuleSet
+    states: List[SolverState]
+    edges: List[Tuple[SolverState, SolverState]]
+
+
 class SolveRunner:
     """
     The main solve runner that delegates each ruleset to a worker and collects the resulting graph.
     """
     def __init__(self, program: ASTProgram,
-                 symbols_in_heads_map=None):
+                 symbols_in_heads_map=None, max_workers: int = 1, deduplicate_states: bool = True,
+                 budget: Optional[Budget] = None, expansion_cache: Optional[ExpansionCache] = None,
+                 literal_assumptions: bool = True, exploration: Optional[Exploration] = None,
+                 aggregate_threshold: Optional[int] = None, aggregate_count_limit: int = 1000,
+                 delta_states: bool = False, materialised_states: int = 1024, checkpoint_dir: Optional[str] = None,
+                 projection: bool = False):
+        """
+        :param program: the (sorted) ASTProgram
+        :param symbols_in_heads_map: mapping from a rule to the signatures in its head
+        :param max_workers: if larger than one, the frontier of each step is expanded by a pool of that many processes
+        :param deduplicate_states: if true, equivalent SolverStates reached through different parents share one node
+        and are only expanded once, which turns the solving tree into a DAG.
+        :param budget: limits on the explored search space, see Budget. If a limit is hit, the graph built so far is
+        returned and SolverStates that were not expanded completely are marked by the node attribute "truncated".
+        :param expansion_cache: if given, the children of each expansion are looked up in and stored into this cache.
+        :param literal_assumptions: if true, every atom is resolved to its program literal once after grounding and
+        assumptions are passed to clingo as lists of integers instead of (Symbol, bool) tuples.
+        :param exploration: which part of the search space is explored, e.g. Beam or Sample. Pruned SolverStates are
+        not part of the graph, their number is stored in the node attribute "pruned" of their parents. By default
+        the search space is explored completely.
+        :param aggregate_threshold: if given, a partial model with more children than this is not expanded into its
+        children but into a single aggregate SolverState. Its model holds the cautious consequences, the node attributes
+        "sometimes", "model_count" and "model_count_is_exact" hold the remaining brave consequences and the number of
+        children. Aggregate states are not expanded any further.
+        :param aggregate_count_limit: the number of children of an aggregate state is counted up to this limit.
+        :param delta_states: if true, SolverStates are stored as DeltaSolverStates, which only keep the difference to
+        their parent. This bounds the memory of deep graphs at the cost of rebuilding models when they are accessed.
+        :param materialised_states: the number of rebuilt models of DeltaSolverStates that are kept.
+        :param checkpoint_dir: if given, the graph and the frontier are stored in this directory after each completed
+        step. Solving the same program with the same assumptions and options again resumes after the last stored step.
+        The checkpoint is removed once solving is complete.
+        :param projection: if true and no rule set can eliminate partial models of the rule sets before it (see
+        can_eliminate_models), the stable models of the entire program are enumerated once and the graph is derived by
+        projecting them onto the head signatures of each prefix, instead of solving once for every partial model.
+        Otherwise, e.g. if the program has integrity constraints, if a rule set uses atoms that a later one derives as
+        in unsorted programs, or if solving is restricted by assumptions, an exploration, an aggregate threshold or a
+        budget, the graph is solved step by step as usual.
+        """
         if symbols_in_heads_map is None:
             symbols_in_heads_map = dict()
         self.prg: ASTProgram = program
         log(f"Created AnotherOne with {len(self.prg)} rules, {symbols_in_heads_map} signatures.")
 
-        self._g: nx.Graph = nx.DiGraph()
-        self._g.add_node(INITIAL_EMPTY_SET)
+        self.atoms = AtomTable()
+        self._g = GraphStore(INITIAL_EMPTY_SET)
+        self._frontier: Dict[int, List[SolverState]] = {INITIAL_EMPTY_SET.step: [INITIAL_EMPTY_SET]}
+        self.deduplicate_states = deduplicate_states
+        self._interned_states: Dict[Tuple, SolverState] = {_state_hash(INITIAL_EMPTY_SET): INITIAL_EMPTY_SET}
+        self._new_states: List[SolverState] = []
+        self._new_edges: List[Tuple[SolverState, SolverState]] = []
+        # The partial models that were solved with the rule set of their step, so that expand doesn't solve them again.
+        self.expanded: Set[SolverState] = set()
+        # The position of each state in the checkpoint, so that the edges of a step can refer to earlier states.
+        self._checkpoint_indices: Dict[SolverState, int] = {INITIAL_EMPTY_SET: 0}
         self._solvers: List[SolveWorker] = []
-        current_prg: FlatASTProgram = []
         self.symbols_in_heads_map = symbols_in_heads_map
 
+        self.max_workers = max_workers
+        self.budget = budget
+        self.exploration = Exploration() if exploration is None else exploration
+        self.aggregate_threshold = aggregate_threshold
+        self.aggregate_count_limit = aggregate_count_limit
+        self.delta_states = delta_states
+        self.materialised = LRUCache(materialised_states)
+        self._timer: Optional[threading.Timer] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        signatures_per_rule_set = []
         for rule_set in self.prg:
-            current_prg.extend(rule_set)
-            ctl = _make_new_control_and_ground(current_prg)
             signatures_of_heads = set()
             for rule in rule_set:
                 signatures_of_heads.update(symbols_in_heads_map.get(str(rule), set()))
-            self._solvers.append(SolveWorker(self, ctl, rule_set, signatures_of_heads))
+            signatures_per_rule_set.append(signatures_of_heads)
+        self._head_signatures = set().union(*signatures_per_rule_set)
+        self.enumerated_models = 0
+        self.duplicate_models = 0
+        self._heads_mask = (0, 0)
+        self._guarded_program = _make_guarded_program(self.prg)
+        self._program_digest = hashlib.sha1(self._guarded_program.encode("utf-8")).hexdigest()
+        self.expansion_cache = expansion_cache
+        self.checkpoints = None if checkpoint_dir is None else GraphCache(checkpoint_dir, max_size=sys.maxsize)
+        self.projection = projection
+        self._ctl: Control = _ground_guarded_program(self._guarded_program)
+        self._active_prefix = -1
+        self.cancelled = False
+        self._started = False
+        self.literal_assumptions = literal_assumptions
+        self._literals: Dict[int, int] = {}
+        if literal_assumptions:
+            for symbolic_atom in self._ctl.symbolic_atoms:
+                if symbolic_atom.symbol.name != GUARD_NAME:
+                    self._literals[self.atoms.id_of(symbolic_atom.symbol)] = symbolic_atom.literal
+        for rule_set, signatures_of_heads in zip(self.prg, signatures_per_rule_set):
+            self._solvers.append(SolveWorker(self, rule_set, signatures_of_heads))
+
+    @property
+    def control(self) -> Control:
+        """
+        The Control in which the guarded program is grounded, shared by all steps.
+        """
+        return self._ctl
+
+    def activate_prefix(self, step: int) -> None:
+        """
+        Restricts the shared Control to the rule sets up to and including step by assigning their guards.
+        :param step: index of the last rule set that should be active.
+        """
+        self._active_prefix = _assign_guards(self._ctl, self._active_prefix, step)
+
+    def make_assumptions(self, trues: int, falses: int) -> Optional[List]:
+        """
+        Creates the assumptions for clingo from bitsets of true and false atoms. Depending on literal_assumptions they
+        are program literals (negative for false atoms) or (Symbol, bool) tuples.
+        :return: the assumptions or None if they can't be satisfied, as an atom that is not part of the program is
+        assumed to be true
+        """
+        if not self.literal_assumptions:
+            return [(atom, True) for atom in self.atoms.decode(trues)] + \
+                   [(atom, False) for atom in self.atoms.decode(falses)]
+        literals = []
+        for atom_id in self.atoms.ids(trues):
+            literal = self._literals.get(atom_id)
+            if literal is None:
+                return None
+            literals.append(literal)
+        literals.extend(-self._literals[atom_id] for atom_id in self.atoms.ids(falses) if atom_id in self._literals)
+        return literals
+
+    def _expansion_key(self, step: int, assumptions: Collection[Tuple[Symbol, bool]]) -> Tuple:
+        return self._program_digest, step, frozenset(assumptions)
+
+    def _get_cached_expansion(self, key: Tuple, max_models: Optional[int]) -> Optional[Tuple[List[Set[Symbol]], bool]]:
+        if self.expansion_cache is None:
+            return None
+        models = self.expansion_cache.get(key)
+        if models is None:
+            return None
+        if max_models is not None and len(models) > max_models:
+            return list(models[:max_models]), False
+        return list(models), True
+
+    def _cache_expansion(self, key: Tuple, models: List[Set[Symbol]], complete: bool) -> None:
+        if self.expansion_cache is not None and complete:
+            self.expansion_cache.put(key, tuple(frozenset(model) for model in models))
+
+    def solve(self, step: int, assumptions: List[Tuple[Symbol, bool]], max_models: Optional[int] = None) \
+            -> Tuple[List[Set[Symbol]], bool]:
+        """
+        Enumerates the children of a partial model on the shared Control, or takes them from the expansion cache.
+        :param step: the step whose prefix should be active.
+        :param assumptions: the assumptions that describe the partial model
+        :param max_models: the maximum number of models enumerated
+        :return: the models found and whether their enumeration was complete
+        """
+        if assumptions is None:
+            return [], True
+        key = self._expansion_key(step, assumptions)
+        cached = self._get_cached_expansion(key, max_models)
+        if cached is not None:
+            return cached
+        models, complete = _solve_for_models(self._ctl, assumptions, max_models)
+        self._cache_expansion(key, models, complete)
+        return models, complete
+
+    def solve_in_parallel(self, step: int, assumptions_per_model: List[List[Tuple[Symbol, bool]]],
+                          max_models: Optional[int] = None) -> List[Tuple[List[Set[Symbol]], bool]]:
+        """
+        Splits the assumptions of a frontier into slices and solves them in the process pool. Expansions found in the
+        expansion cache are not sent to the pool. The results are returned in the order of assumptions_per_model, so
+        the graph is built exactly as in a serial run.
+        :param step: the step whose prefix should be active.
+        :param assumptions_per_model: the assumptions for each partial model of the frontier
+        :param max_models: the maximum number of models enumerated for each partial model
+        :return: the models found for each partial model and whether their enumeration was complete
+        """
+        keys = [None if assumptions is None else self._expansion_key(step, assumptions)
+                for assumptions in assumptions_per_model]
+        results = [([], True) if key is None else self._get_cached_expansion(key, max_models) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) == 0:
+            return results
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.max_workers, initializer=_init_process_control,
+                                             initargs=(self._guarded_program,))
+        # Program literals are the same in each process, as they all ground the same program.
+        as_strings = [[assumption if isinstance(assumption, int) else (str(assumption[0]), assumption[1])
+                       for assumption in assumptions_per_model[i]] for i in missing]
+        slices = _split_into_slices(as_strings, min(len(as_strings), self.max_workers * 4))
+        timeout = None if self.budget is None else self.budget.remaining_time()
+        solved = []
+        for solved_slice in self._pool.map(_solve_slice_in_process, [step] * len(slices),
+                                           [max_models] * len(slices), [timeout] * len(slices), slices):
+            for models, complete in solved_slice:
+                solved.append(([set(clingo.parse_term(atom) for atom in model) for model in models], complete))
+        for i, (models, complete) in zip(missing, solved):
+            results[i] = (models, complete)
+            self._cache_expansion(keys[i], models, complete)
+        return results
+
+    def _start_budget(self) -> None:
+        """
+        Starts the clock of the budget. If it has a timeout, the shared Control is interrupted once it passed.
+        Also resets the exploration.
+        """
+        self._started = True
+        self.exploration.start()
+        if self.budget is None:
+            return
+        self.budget.start()
+        remaining_time = self.budget.remaining_time()
+        if remaining_time is not None:
+            self._timer = threading.Timer(remaining_time, self._ctl.interrupt)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def is_budget_exhausted(self) -> bool:
+        return self.cancelled or (self.budget is not None and self.budget.is_exhausted())
+
+    def cancel(self) -> None:
+        """
+        Stops solving as soon as possible, may be called from another thread. The running solve call of the shared
+        Control is interrupted and the graph built so far is kept, just like when the budget is exhausted.
+        """
+        self.cancelled = True
+        self._ctl.interrupt()
+
+    def count_duplicates(self, models: List[int]) -> None:
+        """
+        Counts the enumerated models of an expansion and how many of them agree with a sibling in all atoms that match
+        a head signature, i.e. how many were enumerated although they do not add a new partial model. With the head
+        signatures of JustTheRulesTransformer.rule2signatures, every atom that can be derived matches one of them, so
+        solving step by step never enumerates such duplicates and projective enumeration would not save anything.
+        Duplicates are only counted if the signatures leave out derived atoms, so the counts are only kept when
+        debugging.
+        :param models: the models as bitsets
+        """
+        self.enumerated_models += len(models)
+        if not self._head_signatures:
+            return
+        if self._heads_mask[0] != len(self.atoms):
+            # Atoms are only ever added to the AtomTable, so the mask only changes if its size did.
+            self._heads_mask = (len(self.atoms), self.atoms.signature_mask(self._head_signatures))
+        heads_mask = self._heads_mask[1]
+        self.duplicate_models += len(models) - len(set(model & heads_mask for model in models))
+
+    def truncate(self, solver_states: Collection[SolverState]) -> None:
+        """
+        Marks SolverStates whose children were not (or not all) computed because the budget was exhausted.
+        The mark is stored as the node attribute "truncated" of the solving graph.
+        """
+        for state in solver_states:
+            self._g.truncate(state)
+
+    def aggregate(self, partial_model: SolverState, rule: ASTRuleSet, step: int, assumptions: Optional[List],
+                  trues: int, falses: int) -> Optional[SolverState]:
+        """
+        Adds a single aggregate SolverState as the child of partial_model instead of all of its children, see
+        aggregate_threshold. The consequences are computed on the shared Control, whose prefix has to be active.
+        :param partial_model: the partial model that has too many children
+        :param rule: the rule set of the step
+        :param step: the step that expands partial_model
+        :param assumptions: the assumptions that describe partial_model, see make_assumptions
+        :param trues: a bitset of the atoms that were assumed to be true
+        :param falses: a bitset of the atoms that were assumed to be false
+        :return: the aggregate SolverState, None if computing the consequences was interrupted
+        """
+        brave, brave_is_complete = _solve_for_consequences(self._ctl, assumptions, "brave")
+        cautious, cautious_is_complete = _solve_for_consequences(self._ctl, assumptions, "cautious")
+        if not (brave_is_complete and cautious_is_complete):
+            self.truncate([partial_model])
+            return None
+        model_count, model_count_is_exact = _count_models(self._ctl, assumptions, self.aggregate_count_limit)
+        model = self.atoms.encode(cautious) | trues
+        state = SolverState.from_bits(model, True, step + 1, falses, model & ~trues, self.atoms)
+        self._g.add_edge(partial_model, state, rule)
+        self._g.attributes(state).update(sometimes=frozenset(brave - cautious), model_count=model_count,
+                                         model_count_is_exact=model_count_is_exact)
+        self._new_edges.append((partial_model, state))
+        self._new_states.append(state)
+        if self.budget is not None:
+            self.budget.add_states(1)
+        return state
+
+    def count_pruned(self, solver_state: SolverState, number: int) -> None:
+        """
+        Adds number to the children of solver_state that were pruned by the exploration. The count is stored as the
+        node attribute "pruned" of the solving graph.
+        """
+        if number:
+            self._g.add_pruned(solver_state, number)
+
+    def _select_frontier(self, step: int) -> None:
+        frontier = self._frontier.get(step, [])
+        kept = self.exploration.select_frontier(frontier)
+        if len(kept) == len(frontier):
+            return
+        kept_states = set(kept)
+        pruned = set(state for state in frontier if state not in kept_states)
+        for state in pruned:
+            for parent in self._g.predecessors(state):
+                self.count_pruned(parent, 1)
+        self._g.remove_states(pruned)
+        if self.budget is not None:
+            self.budget.add_states(-len(pruned))
+        self._frontier[step] = kept
+        self._new_states = [state for state in self._new_states if state not in pruned]
+        self._new_edges = [(u, v) for u, v in self._new_edges if v not in pruned]
+
+    def close(self) -> None:
+        """
+        Shuts down the process pool and the budget timer, if they were started.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @property
+    def graph(self) -> GraphStore:
+        """
+        The solving graph built so far, see make_graph for a networkx.DiGraph.
+        """
+        return self._g
 
     def reset_graph(self):
-        self._g = nx.DiGraph()
-        self._g.add_node(INITIAL_EMPTY_SET)
+        self._g = GraphStore(INITIAL_EMPTY_SET)
+        self._frontier = {INITIAL_EMPTY_SET.step: [INITIAL_EMPTY_SET]}
+        self._interned_states = {_state_hash(INITIAL_EMPTY_SET): INITIAL_EMPTY_SET}
+        self._new_states = []
+        self._new_edges = []
+        self.expanded = set()
+        self._checkpoint_indices = {INITIAL_EMPTY_SET: 0}
+
+    def intern_states(self, solver_states: List[SolverState], table: Optional[Dict] = None) -> List[SolverState]:
+        """
+        Replaces each SolverState by the first equivalent one (same step, model, falses and activity) that was created
+        for the current graph. The adds of a shared state are those of the parent that reached it first.
+        :param solver_states: newly created SolverStates
+        :param table: the states to look the equivalent ones up in, e.g. the siblings of the SolverStates. If None, all
+        states of the graph are used, as long as the SolveRunner deduplicates states.
+        :return: the SolverStates that should be added to the graph
+        """
+        if table is None:
+            if not self.deduplicate_states:
+                return solver_states
+            table = self._interned_states
+        interned = []
+        for state in solver_states:
+            representative = table.setdefault(_state_hash(state), state)
+            if representative is not state and _state_key(representative) != _state_key(state):
+                # The hashes collide, the states are kept apart.
+                representative = state
+            interned.append(representative)
+        return interned
+
+    def memory_per_state(self) -> float:
+        """
+        Returns the average number of bytes each SolverState of the solving graph occupies, not counting the atoms in
+        the AtomTable that all states share.
+        """
+        return sum(sys.getsizeof(state) for state in self._g) / len(self._g)
 
     def find_active_nodes_at_time_step(self, step: int) -> List[SolverState]:
         """
         Returns all solver states in the solving graph at a certain solving step that are still active.
+        The states are looked up in the frontier index that update_graph maintains, so the cost only depends on the
+        number of states at that step and not on the size of the entire graph.
         :param step: the step number.
         :return: a list of SolverStates
         """
-        nodes: List[SolverState] = []
-        for node in self._g:
-            if node.step == step and node.is_still_active:
-                nodes.append(node)
-        return nodes
-
-    def make_graph(self, assumption_sets=None):
-        result_graph = nx.DiGraph()
-        if assumption_sets is None or len(assumption_sets) == 0:
-            for i, s in enumerate(self._solvers):
-                s.run(i, set())
-            result_graph = self._g
-        else:
-            for assumptions in assumption_sets:
-                for i, s in enumerate(self._solvers):
-                    s.run(i, assumptions)
-                result_graph = nx.compose(result_graph, self._g)
-                self.reset_graph()
-        return result_graph
+        return list(self._frontier.get(step, []))
+
+    def can_expand_on_demand(self) -> bool:
+        """
+        Tells whether expand can be used, i.e. whether neither the exploration nor the budget select the frontier of a
+        step, as Beam and max_frontier_size do.
+        """
+        return not self.exploration.selects_frontier() and \
+            (self.budget is None or self.budget.max_frontier_size is None)
+
+    def expand(self, state: SolverState, steps: int = 1, global_assumptions=None) -> List[SolverState]:
+        """
+        Expands a partial model of the solving graph on demand, e.g. starting with INITIAL_EMPTY_SET, so that
+        interactive exploration only solves the part of the search space that is looked at. The children are added to
+        the graph and solved on the shared Control like those of make_graph. Partial models that were expanded before
+        are not solved again, also if make_graph or iter_steps solved them. The budget starts with the first call.
+        Selecting the frontier of a step is not supported, as only some of its partial models are expanded, see
+        can_expand_on_demand. Call close() once exploration is done if max_workers is larger than one or a budget has a
+        timeout.
+        :param state: a SolverState of the solving graph
+        :param steps: the number of steps that state and its descendants are expanded
+        :param global_assumptions: a collection of Symbols and whether they are globally considered true or false
+        :return: the descendants of state that are steps steps further, or fewer if the program ends before
+        """
+        if state not in self._g:
+            raise ValueError(f"{state} is not part of the solving graph.")
+        if not self.can_expand_on_demand():
+            raise ValueError("expand can't select the frontier of a step, as Beam and max_frontier_size do.")
+        if not self._started:
+            self._start_budget()
+        if global_assumptions is None:
+            global_assumptions = set()
+        assumption_index = index_by_signature(global_assumptions)
+        current = [state]
+        for i in range(state.step, min(state.step + steps, len(self._solvers))):
+            unexpanded = [partial_model for partial_model in current
+                          if partial_model.is_still_active and partial_model not in self.expanded]
+            if unexpanded and self.is_budget_exhausted():
+                self.truncate(unexpanded)
+            elif unexpanded:
+                worker = self._solvers[i]
+                self.activate_prefix(i)
+                self._new_states = []
+                self._new_edges = []
+                relevant_assumptions = worker.relevant_assumptions(assumption_index)
+                worker.expand(i, [(partial_model, relevant_assumptions) for partial_model in unexpanded])
+            current = list(dict.fromkeys(child for partial_model in current
+                                         for child in self._g.successors(partial_model)))
+        return current
+
+    def iter_steps(self, global_assumptions=None) -> Iterator[StepIncrement]:
+        """
+        Solves the program step by step and yields the states and edges each step added to the solving graph as soon
+        as they are known. The graph starts with INITIAL_EMPTY_SET. Breaking out of the loop stops solving, the graph
+        built so far stays available.
+        :param global_assumptions: a collection of Symbols and whether they are globally considered true or false
+        :return: an iterator over StepIncrements
+        """
+        self._start_budget()
+        try:
+            yield from self._iter_steps(global_assumptions)
+        finally:
+            self.close()
+
+    def iter_steps_for_assumption_sets(self, assumption_sets) -> Iterator[StepIncrement]:
+        """
+        Like iter_steps, but only explores the solving paths that are consistent with one of several assumption sets,
+        e.g. one for each painter model. Each step is solved once for all of them, see make_graph.
+        :param assumption_sets: collections of Symbols and whether they are considered true or false
+        :return: an iterator over StepIncrements
+        """
+        self._start_budget()
+        try:
+            yield from self._iter_steps_for_assumption_sets(assumption_sets)
+        finally:
+            self.close()
+
+    def _iter_steps(self, global_assumptions=None) -> Iterator[StepIncrement]:
+        if global_assumptions is None:
+            global_assumptions = set()
+        if self.projection and self._can_project(global_assumptions):
+            yield from self._iter_projected_steps()
+            return
+        assumption_index = index_by_signature(global_assumptions)
+        checkpoint_key = self._checkpoint_key([global_assumptions])
+        first_step, _ = self._load_checkpoint(checkpoint_key)
+        for i, s in enumerate(self._solvers[first_step:], first_step):
+            if self.is_budget_exhausted():
+                self.truncate(self._frontier.get(i, []))
+                return
+            self._new_states = []
+            self._new_edges = []
+            s.run(i, global_assumptions, assumption_index)
+            self._select_frontier(i + 1)
+            self._limit_frontier(i + 1)
+            self._save_checkpoint(checkpoint_key, i + 1)
+            yield StepIncrement(i + 1, s.rule, self._new_states, self._new_edges)
+
+    def _can_project(self, global_assumptions) -> bool:
+        """
+        Tells whether the graph can be derived from the projections of the stable models, see projection.
+        """
+        if len(global_assumptions) or type(self.exploration) is not Exploration or \
+                self.aggregate_threshold is not None or self.budget is not None:
+            log("Solving step by step, projection does not support assumptions, explorations, aggregates and budgets.")
+            return False
+        for worker in self._solvers:
+            # Without head signatures, e.g. for integrity constraints, the projection of a prefix is unknown.
+            if not worker.singatures_in_heads or can_eliminate_models(worker.rule, worker.singatures_in_heads):
+                log(f"Solving step by step, {worker.rule} may eliminate partial models.")
+                return False
+        # The projection of a prefix covers every atom of its head signatures. That is only what solving step by step
+        # finds if no atom of a rule set is derived by a later one, as it can be in unsorted programs.
+        later_heads = set()
+        for worker in reversed(self._solvers):
+            if signatures_of(worker.rule) & later_heads:
+                log(f"Solving step by step, {worker.rule} uses atoms that later rule sets derive.")
+                return False
+            later_heads.update(worker.singatures_in_heads)
+        return True
+
+    def _iter_projected_steps(self) -> Iterator[StepIncrement]:
+        """
+        Derives the solving graph from the stable models of the entire program, which are enumerated once. The children
+        of a partial model at step i are the distinct projections of the stable models that extend it onto the head
+        signatures of the rule sets up to i. As no rule set eliminates partial models, these are exactly the partial
+        models solving step by step finds.
+        """
+        self.activate_prefix(len(self._solvers) - 1)
+        models, complete = _solve_for_models(self._ctl, [])
+        if not complete:
+            return
+        models_per_state = {INITIAL_EMPTY_SET: [self.atoms.encode(model) for model in models]}
+        prefix_mask = 0
+        for i, worker in enumerate(self._solvers):
+            self._new_states = []
+            self._new_edges = []
+            heads_mask = self.atoms.signature_mask(worker.singatures_in_heads)
+            prefix_mask |= heads_mask
+            models_per_child = {}
+            for partial_model in self.find_active_nodes_at_time_step(i):
+                projections = {}
+                for model in models_per_state.get(partial_model, ()):
+                    projections.setdefault(model & prefix_mask, []).append(model)
+                children = _make_solver_states_from_bits(list(projections), partial_model._model, i, self.atoms)
+                _consolidate_new_solver_states(partial_model._falses & ~heads_mask, children)
+                models_of_children = [projections.get(child._model, []) for child in children]
+                if self.delta_states:
+                    children = [DeltaSolverState.from_state(child, partial_model, self.materialised)
+                                for child in children]
+                children = self.intern_states(children)
+                self.update_graph(partial_model, worker.rule, children)
+                self.expanded.add(partial_model)
+                for child, models_of_child in zip(children, models_of_children):
+                    # Equivalent children have the same projection, so they are extended by the same models.
+                    models_per_child.setdefault(child, models_of_child)
+            models_per_state = models_per_child
+            yield StepIncrement(i + 1, worker.rule, self._new_states, self._new_edges)
+
+    def _iter_steps_for_assumption_sets(self, assumption_sets) -> Iterator[StepIncrement]:
+        """
+        Solves the program for several assumption sets at once, e.g. one for each painter model. The assumption sets
+        form a trie: at each step, the sets that reached a partial model are grouped by their assumptions that are
+        relevant for the step's rule set, and each group expands the partial model once. So the work depends on the
+        number of distinct prefixes, not on the number of assumption sets. Groups that expand the same partial model
+        share their equivalent children, other states are only shared if the SolveRunner deduplicates states.
+        :param assumption_sets: collections of Symbols and whether they are considered true or false
+        """
+        indices = [index_by_signature(assumptions) for assumptions in assumption_sets]
+        checkpoint_key = self._checkpoint_key(assumption_sets)
+        first_step, reached_by = self._load_checkpoint(checkpoint_key)
+        if reached_by is None:
+            reached_by = {INITIAL_EMPTY_SET: set(range(len(indices)))}
+        for i, s in enumerate(self._solvers[first_step:], first_step):
+            if self.is_budget_exhausted():
+                self.truncate(self._frontier.get(i, []))
+                return
+            self._new_states = []
+            self._new_edges = []
+            self.activate_prefix(i)
+            jobs = []
+            sets_per_job = []
+            for partial_model in self.find_active_nodes_at_time_step(i):
+                groups = {}
+                for set_index in sorted(reached_by.get(partial_model, ())):
+                    relevant_assumptions = s.relevant_assumptions(indices[set_index])
+                    key = frozenset(relevant_assumptions)
+                    if key not in groups:
+                        groups[key] = (relevant_assumptions, [])
+                    groups[key][1].append(set_index)
+                for relevant_assumptions, set_indices in groups.values():
+                    jobs.append((partial_model, relevant_assumptions))
+                    sets_per_job.append(set_indices)
+            log(f"{s.rule} with {len(jobs)} distinct expansions for {len(indices)} assumption sets.")
+            reached_by = {}
+            for set_indices, children in zip(sets_per_job, s.expand(i, jobs, share_siblings=True)):
+                for child in children:
+                    reached_by.setdefault(child, set()).update(set_indices)
+            self._select_frontier(i + 1)
+            self._limit_frontier(i + 1)
+            self._save_checkpoint(checkpoint_key, i + 1, reached_by)
+            yield StepIncrement(i + 1, s.rule, self._new_states, self._new_edges)
+
+    def _checkpoint_key(self, assumption_sets) -> Optional[str]:
+        if self.checkpoints is None or not self.exploration.has_stable_repr():
+            return None
+        assumptions = [sorted(f"{atom}={value}" for atom, value in assumptions) for assumptions in assumption_sets]
+        limits = None if self.budget is None else [self.budget.max_models_per_solve, self.budget.max_frontier_size]
+        return GraphCache.make_key(self._program_digest, assumptions, self.deduplicate_states, repr(self.exploration),
+                                   self.aggregate_threshold, self.aggregate_count_limit, limits)
+
+    def _save_checkpoint(self, key: Optional[str], step: int, reached_by: Optional[Dict] = None) -> None:
+        """
+        Appends the states and edges that step added to the checkpoint, together with the new attributes of the partial
+        models it expanded and its frontier, and records step and the state of the exploration in the head entry.
+        Saving a step thus costs as much as the step, not as the whole graph. Steps that were cut short by the budget or
+        by cancel() are not stored. Once the last step is completed, the checkpoint is removed.
+        :param reached_by: the assumption sets that reached each partial model, see _iter_steps_for_assumption_sets
+        """
+        if key is None or self.is_budget_exhausted():
+            return
+        if step == len(self._solvers):
+            self.checkpoints.remove(key)
+            for i in range(1, step + 1):
+                self.checkpoints.remove(f"{key}-{i}")
+            return
+        indices = self._checkpoint_indices
+        parents = [[indices[state], self._g.is_truncated(state), self._g.pruned(state)]
+                   for state in self._frontier.get(step - 1, []) if state in indices]
+        states = []
+        for state in self._new_states:
+            indices[state] = len(indices)
+            states.append(_state_to_list(state, self._g.node_attributes(state)))
+        self.checkpoints.put(f"{key}-{step}", {
+            "states": states,
+            "edges": [[indices[u], indices[v]] for u, v in self._new_edges],
+            "parents": parents,
+            "frontier": [indices[state] for state in self._frontier.get(step, [])]})
+        reached = None
+        if reached_by is not None:
+            reached = [sorted(reached_by.get(state, ())) for state in self._frontier.get(step, [])]
+        self.checkpoints.put(key, {"step": step, "reached_by": reached, "exploration": self.exploration.get_state()})
+
+    def _load_checkpoint(self, key: Optional[str]) -> Tuple[int, Optional[Dict]]:
+        """
+        Restores the graph, the frontier and the state of the exploration by replaying the steps of a checkpoint, if
+        there is a complete one.
+        :return: the first step that still has to be solved and the assumption sets that reached each partial model of
+        its frontier (None if the checkpoint does not contain them)
+        """
+        data = None if key is None else self.checkpoints.get(key)
+        if data is None:
+            return 0, None
+        step = data["step"]
+        increments = [self.checkpoints.get(f"{key}-{i}") for i in range(1, step + 1)]
+        if any(increment is None for increment in increments):
+            return 0, None
+        g = GraphStore(INITIAL_EMPTY_SET)
+        states = [INITIAL_EMPTY_SET]
+        frontier = {INITIAL_EMPTY_SET.step: [INITIAL_EMPTY_SET]}
+        for i, increment in enumerate(increments):
+            for node in increment["states"]:
+                state, attributes = _state_from_list(node, self.atoms)
+                states.append(state)
+                g.add_state(state)
+                g.add_attributes(state, attributes)
+            for u, v in increment["edges"]:
+                g.add_edge(states[u], states[v], self._solvers[i].rule)
+            for index, is_truncated, pruned in increment["parents"]:
+                if is_truncated:
+                    g.truncate(states[index])
+                g.add_pruned(states[index], pruned - g.pruned(states[index]))
+            frontier[i + 1] = [states[index] for index in increment["frontier"]]
+        self._g = g
+        self._frontier = frontier
+        self._interned_states = {_state_hash(state): state for state in states}
+        self._checkpoint_indices = {state: i for i, state in enumerate(states)}
+        self.expanded = {state for state in states if state.step < step and g.successors(state)}
+        self.exploration.set_state(data["exploration"])
+        if self.budget is not None:
+            self.budget.add_states(len(states) - 1)
+        reached_by = None
+        if data["reached_by"] is not None:
+            reached_by = {state: set(set_indices)
+                          for state, set_indices in zip(self._frontier.get(step, []), data["reached_by"])}
+        log(f"Resuming after step {step} from a checkpoint with {len(states)} states.")
+        return step, reached_by
+
+    def _limit_frontier(self, step: int) -> None:
+        if self.budget is None or self.budget.max_frontier_size is None:
+            return
+        frontier = self._frontier.get(step, [])
+        if len(frontier) > self.budget.max_frontier_size:
+            self.truncate(frontier[self.budget.max_frontier_size:])
+            self._frontier[step] = frontier[:self.budget.max_frontier_size]
+
+    def make_graph(self, assumption_sets=None, store: bool = False) -> Union[nx.DiGraph, GraphStore]:
+        """
+        Creates the solving graph.
+        :param assumption_sets: if given, only the solving paths that are consistent with one of these collections of
+        Symbols and whether they should be true or false are explored, e.g. one for each painter model.
+        :param store: if true, the GraphStore itself is returned, see graph
+        :return: the solving graph exported to a networkx.DiGraph, unless store is true. The export copies every state
+        and edge, so callers that do not need networkx should ask for the store.
+        """
+        self._start_budget()
+        try:
+            if assumption_sets is None or len(assumption_sets) == 0:
+                for _ in self._iter_steps():
+                    pass
+            else:
+                for _ in self._iter_steps_for_assumption_sets(assumption_sets):
+                    pass
+        finally:
+            self.close()
+        log(f"Enumerated {self.enumerated_models} models, {self.duplicate_models} of them duplicated a sibling in "
+            f"the head atoms.")
+        return self._g if store else self._g.to_networkx()
+
+    async def make_graph_async(self, assumption_sets=None, executor: Optional[Executor] = None,
+                               store: bool = False) -> Union[nx.DiGraph, GraphStore]:
+        """
+        Like make_graph, but solves in an executor so that the event loop is not blocked. If the awaiting task is
+        cancelled, solving is cancelled as well, see cancel().
+        :param executor: the executor to solve in, the default executor of the event loop if None.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(executor, self.make_graph, assumption_sets, store)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    def aiter_steps(self, global_assumptions=None, executor: Optional[Executor] = None) -> AsyncIterator[StepIncrement]:
+        """
+        Like iter_steps, but each step is computed in an executor so that the event loop is not blocked.
+        :param executor: the executor to solve in, the default executor of the event loop if None.
+        :return: an asynchronous iterator over StepIncrements
+        """
+        return iterate_in_executor(self.iter_steps(global_assumptions), self, executor)
 
     def update_graph(self, previous: SolverState, rule: str, following_solver_states: Set[SolverState]) -> None:
         """
@@ -224,7 +1523,15 @@ class SolveRunner:
         :param following_solver_states: all SolverStates generated by applying the rule to previous
         """
         for following in following_solver_states:
-            self._g.add_edge(previous, following, rule=rule)
+            is_new = following not in self._g
+            self._g.add_edge(previous, following, rule)
+            self._new_edges.append((previous, following))
+            if is_new:
+                self._new_states.append(following)
+                if self.budget is not None:
+                    self.budget.add_states(1)
+                if following.is_still_active:
+                    self._frontier.setdefault(following.step, []).append(following)
 
 
 
@@ -3,7 +3,7 @@ from copy import copy
 import clingo
 import networkx as nx
 from clingo import ast
-from typing import List, Dict, Tuple
+from typing import List, Dict, Set, Tuple, Union
 
 from vizlo.types import ASTRuleSet, ASTProgram, Program, RuleSet
 from vizlo.util import log
@@ -155,30 +155,76 @@ class JustTheRulesTransformer(Transformer):
         return rules
 
     def transform(self, program, sort=True) -> ASTProgram:
+        """
+        :param sort: True or one of SORT_ORDERS to sort the rules by their dependencies ("topological" if True), False
+        to keep every rule in its own rule set in program order.
+        """
         rules = self._split_program_into_rules(program)
         if sort:
-            rules = self.sort(rules)
+            rules = self.sort(rules, "topological" if sort is True else sort)
         else:
             rules = [[rule] for rule in rules]
         return rules
 
-    def sort_program_by_dependencies(self, parse: ASTRuleSet) -> Program:
+    def sort_program_by_dependencies(self, parse: ASTRuleSet, order: str = "topological") -> Program:
+        """
+        :param order: "topological" for any order in which each rule set comes after the rule sets it depends on,
+        "min_frontier" for such an order that keeps the intermediate frontiers small, see min_frontier_key.
+        """
+        if order not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort order {order}, expected one of {SORT_ORDERS}.")
         log(f"Parse: {parse} ({len(parse)})")
         deps = self.make_dependency_graph(parse, self._head_signature2rule, self._body_signature2rule)
         deps = merge_cycles(deps)
         deps = remove_loops(deps)
         self._deps = deps  # for debugging purposes
-        program = list(nx.topological_sort(deps))
+        if order == "min_frontier":
+            program = list(nx.lexicographical_topological_sort(deps, key=min_frontier_key(parse)))
+        else:
+            program = list(nx.topological_sort(deps))
         return program
 
-    def sort(self, program: ASTRuleSet) -> ASTProgram:
-        sorted_program = self.sort_program_by_dependencies(program)
+    def sort(self, program: ASTRuleSet, order: str = "topological") -> ASTProgram:
+        sorted_program = self.sort_program_by_dependencies(program, order)
         rules = []
         for rule_set in sorted_program:
             rules.append(parse_rule_set(rule_set))
         return rules
 
 
+SORT_ORDERS = ("topological", "min_frontier")
+
+
+def _rule_cost(rule: ast.AST) -> int:
+    """
+    Estimates how much a rule widens the frontier: integrity constraints only narrow it (0), rules with a single head
+    atom derive it deterministically (1), choice rules, disjunctions and head aggregates may multiply it (2).
+    """
+    if rule.type != ast.ASTType.Rule:
+        return 1
+    head = rule.head
+    if head.type == ast.ASTType.Literal:
+        return 0 if head.atom.type == ast.ASTType.BooleanConstant else 1
+    return 2
+
+
+def min_frontier_key(program: ASTRuleSet):
+    """
+    Creates the key by which the "min_frontier" order breaks ties between rule sets whose dependencies are solved:
+    constraints first and choices last, so that they are narrowed before they are multiplied. Rule sets of the same
+    cost keep the order of the program.
+    :param program: the rules of the program as ASTs
+    :return: a function mapping a rule set, i.e. a frozenset of rules as strings, to a sortable key
+    """
+    costs = {}
+    positions = {}
+    for position, rule in enumerate(program):
+        costs.setdefault(str(rule), _rule_cost(rule))
+        positions.setdefault(str(rule), position)
+    return lambda rule_set: (max(costs.get(rule, 1) for rule in rule_set),
+                             min(positions.get(rule, len(program)) for rule in rule_set))
+
+
 def merge_nodes(nodes: frozenset) -> frozenset:
     old = set()
     for x in nodes:
@@ -207,6 +253,90 @@ def remove_loops(g: nx.Graph) -> nx.Graph:
     return g
 
 
+class _NonMonotoneSignatureCollector(Visitor):
+    """
+    Collects the signatures of the atoms that occur negated or within aggregates.
+    """
+
+    def __init__(self):
+        self.signatures = set()
+
+    def visit_Literal(self, literal, non_monotone=False):
+        self.visit_children(literal, non_monotone=non_monotone or literal.sign != ast.Sign.NoSign)
+
+    def visit_Aggregate(self, aggregate, non_monotone=False):
+        self.visit_children(aggregate, non_monotone=True)
+
+    def visit_BodyAggregate(self, aggregate, non_monotone=False):
+        self.visit_children(aggregate, non_monotone=True)
+
+    def visit_Function(self, function, non_monotone=False):
+        if non_monotone:
+            self.signatures.add(make_signature(function))
+
+
+# Statements that neither derive atoms nor restrict the models of a program.
+_NEUTRAL_STATEMENTS = ("ShowSignature", "ShowTerm", "Defined")
+
+
+def can_eliminate_models(rule_set: ASTRuleSet, signatures_in_heads) -> bool:
+    """
+    Tells whether a rule set may eliminate partial models of the rule sets before it, i.e. whether a partial model of
+    the preceding prefix may have no extension under this rule set. The check is conservative: integrity constraints,
+    choice rules with bounds, head aggregates and negated or aggregated atoms that the rule set derives itself (which
+    may form odd loops) are considered to eliminate partial models, as is any statement it does not know.
+    :param rule_set: the rule set consisting of rules as strings or ASTs
+    :param signatures_in_heads: the signatures of the atoms in the heads of the rule set
+    """
+    for rule in rule_set:
+        if isinstance(rule, str):
+            if can_eliminate_models(parse_rule_set([rule]), signatures_in_heads):
+                return True
+            continue
+        if str(rule.type) in _NEUTRAL_STATEMENTS:
+            continue
+        if rule.type != ast.ASTType.Rule:
+            return True
+        head = rule.head
+        if head.type == ast.ASTType.Literal:
+            if head.sign != ast.Sign.NoSign or head.atom.type == ast.ASTType.BooleanConstant:
+                return True
+        elif head.type == ast.ASTType.Aggregate:
+            if head.left_guard is not None or head.right_guard is not None:
+                return True
+        elif head.type != ast.ASTType.Disjunction:
+            return True
+        collector = _NonMonotoneSignatureCollector()
+        collector.visit(rule.body)
+        if collector.signatures & set(signatures_in_heads):
+            return True
+    return False
+
+
+class _SignatureCollector(Visitor):
+    """
+    Collects the signatures of all functions, i.e. of the atoms and of the function terms in their arguments.
+    """
+
+    def __init__(self):
+        self.signatures = set()
+
+    def visit_Function(self, function):
+        self.signatures.add(make_signature(function))
+        self.visit_children(function)
+
+
+def signatures_of(rule_set: ASTRuleSet) -> Set[Tuple[str, int]]:
+    """
+    :param rule_set: the rule set consisting of rules as strings or ASTs
+    :return: the signatures of all atoms that occur in the rule set, in heads, bodies or conditions
+    """
+    collector = _SignatureCollector()
+    for rule in rule_set:
+        collector.visit(parse_rule_set([rule]) if isinstance(rule, str) else rule)
+    return collector.signatures
+
+
 def add_to_list_if_is_not_program(rule: clingo.ast.AST, lst: List) -> None:
     if rule is not None and not rule.type == clingo.ast.ASTType.Program:
         lst.append(rule)
@@ -219,14 +349,39 @@ def parse_rule_set(rule_set: RuleSet) -> ASTRuleSet:
     return ast_rule_set
 
 
-def transform(program: str, sort: bool = True) -> ASTProgram:
+def guard_rule_set(rule_set: RuleSet, guard: str) -> RuleSet:
+    """
+    Extends the body of every rule in a rule set by an additional literal, so that the rules only fire if the guard
+    holds. Statements that are not rules are returned unchanged.
+    :param rule_set: a rule set consisting of rules as strings or ASTs
+    :param guard: the literal that will be added to each body as a string
+    :return: the guarded rule set as a list of strings
+    """
+    ast_rule_set = []
+    for rule in rule_set:
+        if isinstance(rule, str):
+            clingo.parse_program(rule, lambda ast_rule: add_to_list_if_is_not_program(ast_rule, ast_rule_set))
+        else:
+            ast_rule_set.append(rule)
+    guarded = []
+    for rule in ast_rule_set:
+        if rule.type == clingo.ast.ASTType.Rule:
+            body = [str(literal) for literal in rule.body]
+            body.append(guard)
+            guarded.append(f"{rule.head} :- {'; '.join(body)}.")
+        else:
+            guarded.append(str(rule))
+    return guarded
+
+
+def transform(program: str, sort: Union[bool, str] = True) -> ASTProgram:
     """
     Receives a logic program as a string and returns an ASTProgram. An ASTProgram consists of multiple
     RuleSets that each contain Rules that are interdependent of each.
     If they are sorted, the RuleSet at index i does only depend on RuleSets with index j>i.
     :param program: a logic program as a string
-    :param sort: whether to sort by dependencies. This should always be true, vizlo does not guarantee correct results
-    for unsorted programs.
+    :param sort: whether to sort by dependencies. This should always be true or one of SORT_ORDERS, vizlo does not
+    guarantee correct results for unsorted programs.
     :return: a sorted (or unsorted) ASTProgram consisting of RuleSets consisting of Rules.
     """
     t = JustTheRulesTransformer()
@@ -279,7 +434,7 @@ class FindRecursiveRulesTransformer(JustTheRulesTransformer):
     def transform(self, program, sort=True) -> ASTProgram:
         rules = self._split_program_into_rules(program)
         if sort:
-            rules = self.sort(rules)
+            rules = self.sort(rules, "topological" if sort is True else sort)
         else:
             rules = [[rule] for rule in rules]
         return rules
@@ -295,10 +450,15 @@ class FindRecursiveRulesTransformer(JustTheRulesTransformer):
                     g.add_edge(frozenset([str(dependent_rule)]), frozenset([str(rule_with_body_signature)]))
         return g
 
-    def sort_program_by_dependencies(self, parse: ASTRuleSet) -> Program:
+    def sort_program_by_dependencies(self, parse: ASTRuleSet, order: str = "topological") -> Program:
+        if order not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort order {order}, expected one of {SORT_ORDERS}.")
         log(f"Parse: {parse} ({len(parse)})")
         deps = self.make_dependency_graph(parse, self._dependency_map)
         deps = merge_cycles(deps)
         deps = remove_loops(deps)
-        program = list(nx.topological_sort(deps))
+        if order == "min_frontier":
+            program = list(nx.lexicographical_topological_sort(deps, key=min_frontier_key(parse)))
+        else:
+            program = list(nx.topological_sort(deps))
         return program